@@ -15,6 +15,7 @@ import chambers_and_audiences as ca
 import communities as cm
 import similarity_metrics as sm
 import polarization as pol
+import network_store as ns
 
 # HELPER FUNCS 
 def get_filenames_from_path(path, extension='.csv'):
@@ -43,9 +44,13 @@ tic = time()
 
 ## EDGELISTS ##
 DATA_NWS_PATH = './weekly_retweet_networks/'
-networks_names = sorted( get_filenames_from_path(DATA_NWS_PATH) )
+DATA_STORE_PATH = './weekly_retweet_networks_store/' # columnar (memory-mapped) copy of the weekly networks
 
-edgelists = os.listdir(DATA_NWS_PATH)
+# the csv files are parsed only once, then every run reads the columnar store
+if not os.path.exists( DATA_STORE_PATH ):
+    ns.convert_weekly_networks( DATA_NWS_PATH, DATA_STORE_PATH )
+
+edgelists = ns.load_weekly_networks( DATA_STORE_PATH, as_dataframe=True )
 # obtain all timestamps from the edgelist
 times = timestamps_from_date( len(edgelists) , date_format='%d-%m-%Y')
 
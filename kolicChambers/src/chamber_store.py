@@ -0,0 +1,320 @@
+import os
+import pickle
+import hashlib
+import weakref
+from collections import OrderedDict, Counter
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+# local
+import chambers_and_audiences as ca
+from retweet_graph import RetweetGraph, build_retweet_graph
+
+###################### MEMOIZED CHAMBERS AND AUDIENCES ######################
+class ChamberStore:
+    '''Memoizing store of audiences and chambers, keyed by (week fingerprint, user, hash of users_excluded).
+
+    Weeks are identified by a fingerprint of their edges (see week_fingerprint), so the same week passed again (even as a
+    different dataframe object) hits the store. At most `max_items` sets are kept in memory (least recently used first out);
+    if spill_path is given, evicted sets are written there and read back on the next request instead of being recomputed.
+    The RetweetGraphs of the last `max_graphs` weeks are kept too, so cache misses do not rescan the edgelist.
+
+    Pass the store as `store=` to chambers_and_audiences.get_audience, get_chamber, get_chamber_edgelist, temporal_chambers
+    and temporal_audiences, or use its methods directly.
+    '''
+
+    def __init__( self, max_items=100000, spill_path=None, max_graphs=8, source='source', target='target', weight='weight', user_ids=None ):
+
+        self.max_items = max_items
+        self.spill_path = spill_path
+        self.max_graphs = max_graphs
+        self.source = source
+        self.target = target
+        self.weight = weight
+        self.user_ids = user_ids
+
+        self.items = OrderedDict()   # key -> set of users (LRU order)
+        self.graphs = OrderedDict()  # week fingerprint -> RetweetGraph (LRU order)
+        self.spilled = set()         # keys written to spill_path
+        self._fingerprints = dict()  # id(edgelist) -> (weakref to edgelist, fingerprint)
+        self._fingerprint_ids = dict()     # fingerprint -> ids of the edgelists with that fingerprint
+        self._fingerprint_items = Counter() # fingerprint -> number of its sets kept in memory
+
+        self.hits = 0
+        self.misses = 0
+
+        if spill_path is not None:
+            os.makedirs( spill_path, exist_ok=True )
+
+    def __len__( self ):
+        return len( self.items )
+
+    ## SINGLE USERS
+    def audience( self, user, edgelist ):
+        '''Returns the (memoized) audience of user in edgelist, see chambers_and_audiences.get_audience.
+        '''
+        fingerprint = self.fingerprint( edgelist )
+        key = ( 'audience', fingerprint, user, None )
+
+        audience = self._get( key )
+        if audience is None:
+            audience = ca.get_audience( user, self.graph( edgelist, fingerprint ) )
+            self._put( key, audience )
+        return audience
+
+    def chamber( self, user, edgelist, users_excluded=False ):
+        '''Returns the (memoized) chamber of user in edgelist, see chambers_and_audiences.get_chamber.
+        '''
+        fingerprint = self.fingerprint( edgelist )
+        key = ( 'chamber', fingerprint, user, exclusion_key( users_excluded ) )
+
+        chamber = self._get( key )
+        if chamber is None:
+            chamber = ca.get_chamber_from_audience( user, self.graph( edgelist, fingerprint ), self.audience( user, edgelist ), users_excluded=users_excluded )
+            self._put( key, chamber )
+        return chamber
+
+    def chamber_edgelist( self, user, edgelist, users_excluded=False ):
+        '''Returns the chamber network of user (not memoized, only its chamber is).
+        '''
+        return ca.get_edgelist_from_chamber( self.chamber( user, edgelist, users_excluded ), self.network_source( edgelist ), self.source, self.target )
+
+    def audience_edgelist( self, user, edgelist ):
+        '''Returns the audience network of user (not memoized, only its audience is).
+        '''
+        return ca.get_edgelist_from_audience( self.audience( user, edgelist ), self.network_source( edgelist ), self.source, self.target )
+
+    ## MANY USERS
+    def chambers_of_users( self, users, edgelist, users_excluded=False, return_network=False, batched=False, views=False ):
+        '''See chambers_and_audiences.get_chambers_of_users. If batched, the chambers missing from the store are computed
+        with one sparse matrix product. If return_network, the networks are a LazyNetworks mapping, materialized on access
+        (or zero-copy SubNetworkView's of the week's graph, if views).
+        '''
+        fingerprint = self.fingerprint( edgelist )
+        excluded_key = exclusion_key( users_excluded )
+
+        computed = dict()
+        if batched:
+            missing = [ user for user in users if not self._contains( ( 'chamber', fingerprint, user, excluded_key ) ) ]
+            if len(missing) > 0:
+                batched_chambers = ca.get_chambers_batched( missing, self.graph( edgelist, fingerprint ), users_excluded=users_excluded )
+                self.misses += len( missing )
+                for user in missing:
+                    self._put( ( 'chamber', fingerprint, user, excluded_key ), batched_chambers[user] )
+                    computed[user] = batched_chambers[user]
+
+        chambers_dict = { user: computed[user] if user in computed else self.chamber( user, edgelist, users_excluded ) for user in users }
+
+        if return_network:
+            return chambers_dict, self._networks( chambers_dict, edgelist, fingerprint, views )
+        else:
+            return chambers_dict
+
+    def audiences_of_users( self, users, edgelist, return_network=False, views=False ):
+        '''See chambers_and_audiences.get_audiences_of_users (and chambers_of_users for views).
+        '''
+        audiences_dict = { user: self.audience( user, edgelist ) for user in users }
+
+        if return_network:
+            return audiences_dict, self._networks( audiences_dict, edgelist, self.fingerprint( edgelist ), views )
+        else:
+            return audiences_dict
+
+    def temporal_chambers( self, users, edgelists, users_excluded=False, return_networks=False, batched=False, views=False ):
+        '''See chambers_and_audiences.temporal_chambers (weeks are processed in this process, in order).
+        '''
+        list_of_lists = False
+        if users_excluded is not False:
+            list_of_lists = (type(users_excluded[0]) == list) | (type(users_excluded[0]) == set)
+
+        results = []
+        for (t, edgelist) in enumerate( edgelists ):
+            excluded_t = users_excluded[t] if list_of_lists else users_excluded
+            results.append( self.chambers_of_users( users[t], edgelist, excluded_t, return_networks, batched, views ) )
+
+        if return_networks:
+            return [ chambers for (chambers, _) in results ], [ networks for (_, networks) in results ]
+        else:
+            return results
+
+    def temporal_audiences( self, users, edgelists, return_networks=False, views=False ):
+        '''See chambers_and_audiences.temporal_audiences.
+        '''
+        results = [ self.audiences_of_users( users[t], edgelist, return_networks, views ) for (t, edgelist) in enumerate( edgelists ) ]
+
+        if return_networks:
+            return [ audiences for (audiences, _) in results ], [ networks for (_, networks) in results ]
+        else:
+            return results
+
+    ## WEEKS
+    def fingerprint( self, edgelist ):
+        '''Returns the fingerprint of edgelist, hashed once per edgelist object.
+        '''
+        cached = self._fingerprints.get( id( edgelist ) )
+        if cached is not None and cached[0]() is edgelist:
+            return cached[1]
+
+        fingerprint = week_fingerprint( edgelist, self.source, self.target, self.weight )
+        # weak reference, so that the store does not keep the edgelists alive (the entry goes with the edgelist)
+        key = id( edgelist )
+        self._fingerprints[ key ] = ( weakref.ref( edgelist, lambda ref: self._forget_edgelist( key, ref ) ), fingerprint )
+        self._fingerprint_ids.setdefault( fingerprint, set() ).add( key )
+        return fingerprint
+
+    def graph( self, edgelist, fingerprint=None ):
+        '''Returns the (cached) RetweetGraph of edgelist.
+        '''
+        if isinstance( edgelist, RetweetGraph ):
+            return edgelist
+        if fingerprint is None:
+            fingerprint = self.fingerprint( edgelist )
+
+        if fingerprint in self.graphs:
+            self.graphs.move_to_end( fingerprint )
+            return self.graphs[ fingerprint ]
+
+        graph = build_retweet_graph( edgelist, source=self.source, target=self.target, weight=self.weight, user_ids=self.user_ids )
+        self.graphs[ fingerprint ] = graph
+        if len( self.graphs ) > self.max_graphs:
+            old_fingerprint, _ = self.graphs.popitem( last=False )
+            self._release_fingerprint( old_fingerprint )
+        return graph
+
+    def network_source( self, edgelist ):
+        '''Returns what the networks of the sets of edgelist are filtered from: the edgelist itself or, if the sets are arrays
+        of global user IDs (user_ids), its RetweetGraph, since the IDs cannot filter the user names of the dataframe.
+        '''
+        if self.user_ids is None:
+            return edgelist
+        return self.graph( edgelist )
+
+    def check_arguments( self, source='source', target='target', user_ids=None, n_jobs=None, executor=None ):
+        '''Raises ValueError if the arguments of a chambers_and_audiences call conflict with the store.
+        '''
+        if (n_jobs is not None) or (executor is not None):
+            raise ValueError( "A ChamberStore is kept in this process, it cannot be used with n_jobs or executor." )
+        if (source, target) != (self.source, self.target):
+            raise ValueError( "source and target differ from those of the ChamberStore ({}, {}).".format( self.source, self.target ) )
+        if (user_ids is not None) and (user_ids is not self.user_ids):
+            raise ValueError( "user_ids differs from the user dictionary of the ChamberStore." )
+
+    def clear( self ):
+        '''Empties the store, including the spilled sets.
+        '''
+        for key in self.spilled:
+            os.remove( self._spill_file( key ) )
+        self.items.clear()
+        self.graphs.clear()
+        self.spilled.clear()
+        self._fingerprints.clear()
+        self._fingerprint_ids.clear()
+        self._fingerprint_items.clear()
+
+    ## Helpers
+    def _contains( self, key ):
+        return ( key in self.items ) or ( key in self.spilled )
+
+    def _networks( self, sets_dict, edgelist, fingerprint, views ):
+        if views:
+            graph = self.graph( edgelist, fingerprint )
+            return { user: graph.subnetwork( graph.encode( users ) ) for (user, users) in sets_dict.items() }
+        return LazyNetworks( sets_dict, self.network_source( edgelist ), self.source, self.target )
+
+    def _get( self, key ):
+        if key in self.items:
+            self.items.move_to_end( key )
+            self.hits += 1
+            return self.items[ key ]
+
+        if key in self.spilled:
+            with open( self._spill_file( key ), 'rb' ) as f:
+                value = pickle.load( f )
+            self.hits += 1
+            self._put( key, value )
+            return value
+
+        self.misses += 1
+        return None
+
+    def _put( self, key, value ):
+        if key not in self.items:
+            self._fingerprint_items[ key[1] ] += 1
+        self.items[ key ] = value
+        self.items.move_to_end( key )
+
+        while len( self.items ) > self.max_items:
+            old_key, old_value = self.items.popitem( last=False )
+            if self.spill_path is not None and old_key not in self.spilled:
+                with open( self._spill_file( old_key ), 'wb' ) as f:
+                    pickle.dump( old_value, f, protocol=pickle.HIGHEST_PROTOCOL )
+                self.spilled.add( old_key )
+
+            self._fingerprint_items[ old_key[1] ] -= 1
+            self._release_fingerprint( old_key[1] )
+
+    def _release_fingerprint( self, fingerprint ):
+        # the edgelist -> fingerprint entries are dropped once nothing of the week is cached (it is rehashed if it comes back)
+        if self._fingerprint_items[ fingerprint ] > 0 or fingerprint in self.graphs:
+            return
+        del self._fingerprint_items[ fingerprint ]
+        for key in self._fingerprint_ids.pop( fingerprint, () ):
+            self._fingerprints.pop( key, None )
+
+    def _forget_edgelist( self, key, ref ):
+        cached = self._fingerprints.get( key )
+        if cached is not None and cached[0] is ref:
+            del self._fingerprints[ key ]
+            self._fingerprint_ids.get( cached[1], set() ).discard( key )
+
+    def _spill_file( self, key ):
+        return os.path.join( self.spill_path, _hash_bytes( repr( key ).encode() ) + '.pkl' )
+
+class LazyNetworks( Mapping ):
+    '''Read-only dict{user:network} whose networks (see chambers_and_audiences.get_edgelist_from_chamber) are only built
+    when accessed, and are not kept. edgelist can be a dataframe or a RetweetGraph (needed for sets of global user IDs).
+    '''
+
+    def __init__( self, sets_dict, edgelist, source='source', target='target' ):
+        self.sets_dict = sets_dict
+        self.edgelist = edgelist
+        self.source = source
+        self.target = target
+
+    def __getitem__( self, user ):
+        return ca.get_edgelist_from_chamber( self.sets_dict[ user ], self.edgelist, self.source, self.target )
+
+    def __iter__( self ):
+        return iter( self.sets_dict )
+
+    def __len__( self ):
+        return len( self.sets_dict )
+
+## Keys
+def week_fingerprint( edgelist, source='source', target='target', weight='weight' ):
+    '''Returns a hex digest of the edges of edgelist:(dataframe or RetweetGraph).
+    '''
+    if isinstance( edgelist, RetweetGraph ):
+        arrays = [ edgelist.sources, edgelist.targets, edgelist.weights ]
+        # the labels of the users of the edges, so that weeks with the same structure over different users do not collide
+        used = np.unique( np.concatenate( [ edgelist.sources, edgelist.targets ] ) )
+        label_hashes = pd.util.hash_array( np.asarray( edgelist.users[ used ], dtype=object ) )
+        arrays += [ used, label_hashes ]
+        return _hash_bytes( b''.join( np.ascontiguousarray( array ).tobytes() for array in arrays ) + str( edgelist.num_users ).encode() )
+
+    columns = [ column for column in [ source, target, weight ] if column in edgelist.columns ]
+    row_hashes = pd.util.hash_pandas_object( edgelist[ columns ], index=False ).to_numpy()
+    return _hash_bytes( row_hashes.tobytes() )
+
+def exclusion_key( users_excluded ):
+    '''Returns a hashable key of users_excluded:(False or collection of users), independent of its order.
+    '''
+    if users_excluded is False:
+        return False
+
+    if isinstance( users_excluded, np.ndarray ) and users_excluded.dtype.kind in 'iu':
+        return _hash_bytes( np.unique( users_excluded ).astype( np.int64 ).tobytes() )
+    return _hash_bytes( '\x00'.join( sorted( set( map( str, users_excluded ) ) ) ).encode() )
+
+def _hash_bytes( data ):
+    return hashlib.blake2b( data, digest_size=16 ).hexdigest()
@@ -1,5 +1,9 @@
 import numpy as np
+import pandas as pd
 from collections import Counter
+# local
+from retweet_graph import RetweetGraph, build_retweet_graph, as_retweet_graph
+import weekly_pool as wp
 
 ###################### IMPACT AND LEADING PERSISTENT USERS ######################
 def temporal_highimpact_impacts( edgelists, num_highimpact_users, target='target', weight='weight'):
@@ -52,18 +56,30 @@ def temporal_leading_impacts(edgelists, num_highimpact_users, num_persistent_use
 
     return persistent_impact_vec, persistent_users_vec, users_persistence
 
-def get_impact_vector(edgelist, target='target', weight='weight'):
+def get_impact_vector(edgelist, target='target', weight='weight', fast=True):
     """ Returns impact vector for all users in edgelist.
+    edgelist can be a dataframe or a RetweetGraph. If fast, the impacts are accumulated with np.bincount over integer-coded targets.
     """
-    return edgelist.groupby( target ).sum().sort_values( weight )
+    if fast or isinstance( edgelist, RetweetGraph ):
+        users, impacts = get_impact_arrays( edgelist, target=target, weight=weight )
+        order = np.argsort( impacts, kind='stable' )
+        return _impact_dataframe( users[ order ], impacts[ order ], target, weight )
+
+    # only the weights are aggregated (summing the source column concatenates strings), and categorical 
+    # targets (see network_store) only keep the users present in edgelist
+    return edgelist.groupby( target, observed=True )[ [weight] ].sum().sort_values( weight )
 
 # In the article, N = 50 leading weekly users, M = 50 of persistent users
-def get_leading_impact_vector(edgelist, num_leading_users, target='target', weight='weight'):
+def get_leading_impact_vector(edgelist, num_leading_users, target='target', weight='weight', fast=True):
     """ Return impact vector for leading (N) persistent (M) users in edgelist.
     If num_leading_users:float in [0,1], it is treated as a percentage. If num_leading_users:int > 0, it is treated as absolute number of users.
+    If fast, only the leading users are selected (np.argpartition) and sorted, instead of sorting the whole impact vector.
     """
 
-    impact_vec = get_impact_vector( edgelist, target=target, weight=weight )
+    if fast or isinstance( edgelist, RetweetGraph ):
+        return get_leading_impact_vector_fast( edgelist, num_leading_users, target=target, weight=weight )
+
+    impact_vec = get_impact_vector( edgelist, target=target, weight=weight, fast=False )
 
     if 0 < num_leading_users < 1:
 
@@ -87,19 +103,93 @@ def get_leading_impact_vector(edgelist, num_leading_users, target='target', weig
     else:
         print('Some error for {}'.format(num_leading_users))
 
+def get_leading_impact_vector_fast(edgelist, num_leading_users, target='target', weight='weight'):
+    """ Same as get_leading_impact_vector, with a partial selection of the leading users.
+
+    For a percentage p, the users kept are those whose share of the cumulative (ascending) impact is above p, i.e. the top users
+    such that the impact of the users above each of them is below (1-p) of the total. The top k users are selected with 
+    np.argpartition, doubling k until the cutoff is reached, so the long tail of low-impact users is never sorted.
+    """
+
+    users, impacts = get_impact_arrays( edgelist, target=target, weight=weight )
+
+    if 0 < num_leading_users < 1:
+
+        ## Option 1: based on percentage of retweets
+        total_impact = impacts.sum()
+        k = min( len(impacts), 64 )
+        while True:
+            top = _top_k( impacts, k )[::-1] # descending
+            impact_above = np.cumsum( impacts[top] ) - impacts[top]
+            num_kept = np.count_nonzero( impact_above < (1 - num_leading_users)*total_impact )
+
+            if (num_kept < k) or (k == len(impacts)):
+                break
+            k = min( 2*k, len(impacts) )
+
+        top = top[ :num_kept ][::-1]
+        return _impact_dataframe( users[top], impacts[top], target, weight )
+
+    elif (type(num_leading_users) == int) & (num_leading_users > 0):
+
+        top = _top_k( impacts, num_leading_users )
+        return _impact_dataframe( users[top], impacts[top], target, weight )
+
+    else:
+        print('Some error for {}'.format(num_leading_users))
+
+def get_impact_arrays(edgelist, target='target', weight='weight'):
+    """ Returns the arrays (users, impacts) with the total weight retweeted of every target user in edgelist (unsorted).
+    """
+
+    if isinstance( edgelist, RetweetGraph ):
+        impacts = np.bincount( edgelist.targets, weights=edgelist.weights, minlength=edgelist.num_users )
+        users = np.flatnonzero( np.bincount( edgelist.targets, minlength=edgelist.num_users ) )
+        return edgelist.users[ users ], _as_weight_dtype( impacts[ users ], edgelist.weights )
+
+    codes, users = pd.factorize( edgelist[ target ] )
+    weights = edgelist[ weight ].to_numpy()
+
+    # missing targets are coded -1, dropped as groupby does
+    if ( codes < 0 ).any():
+        weights = weights[ codes >= 0 ]
+        codes = codes[ codes >= 0 ]
+    impacts = np.bincount( codes, weights=weights, minlength=len(users) )
+
+    return np.asarray( users ), _as_weight_dtype( impacts, weights )
+
+# helpers
+def _top_k( values, k ):
+    '''Returns the positions of the k largest values sorted in ascending order, without sorting the rest.
+    '''
+    k = min( k, len(values) )
+    if k == 0:
+        return np.zeros( 0, dtype=np.int64 )
+
+    top = np.argpartition( values, len(values) - k )[ len(values) - k: ]
+    return top[ np.argsort( values[top], kind='stable' ) ]
+
+def _impact_dataframe( users, impacts, target, weight ):
+    return pd.DataFrame( { weight: impacts }, index=pd.Index( users, name=target ) )
+
+def _as_weight_dtype( impacts, weights ):
+    # np.bincount accumulates in float, keep integer weights as integers
+    if weights.dtype.kind in 'iu':
+        return np.rint( impacts ).astype( np.int64 )
+    return impacts
+
 
 def get_users_persistence(users_array):#, num_users=None):
     '''Return a dictionary of all the users in `influential_users:list[set]` as well as their persistence.
+    See impact_tracker.ImpactTracker to update the persistence one week at a time.
     '''
     
-    users_persistence = np.array([])
-
-    # append all users into a single array
+    # count the users of every week in place (appending them into a single array copies it every week)
+    users_persistence = Counter()
     for users in users_array:
         
-        users_persistence = np.append(users_persistence, np.array(list(users)))
+        users_persistence.update( users )
     
-    users_persistence = Counter( users_persistence )
     users_persistence = {k: v for k, v in sorted(users_persistence.items(), key=lambda item: item[1], reverse=True)}
     
     return Counter(users_persistence)
@@ -112,16 +202,30 @@ def get_users_from_users_persistence_dict( users_persistence ):
 
 ###################### CHAMBERS & AUDIENCES ###################### 
 
-def get_audience( user, edgelist, source='source', target='target' ):
+def get_audience( user, edgelist, source='source', target='target', store=None ):
     '''Returns the audience:set of the user given an edgelist.
+
+    edgelist can also be a RetweetGraph (see retweet_graph.build_retweet_graph), in which case the lookup is O(in-degree).
+    If store:chamber_store.ChamberStore is given, the audience is memoized in it.
     '''
+    if store is not None:
+        return store.audience( user, edgelist )
+    if isinstance( edgelist, RetweetGraph ):
+        return get_audience_from_graph( user, edgelist )
+
     return set( edgelist[ edgelist[ target ] == user ][ source ].unique() )
 
-def get_chamber( user, edgelist, users_excluded=False, source='source', target='target'):
+def get_chamber( user, edgelist, users_excluded=False, source='source', target='target', store=None):
     """Returns the chamber:set of the user given an edgelist.
 
     users_excluded can be either False or a list of users to exclude from chamber.
+    edgelist can also be a RetweetGraph, in which case the lookup is O(sum of the audience out-degrees).
+    If store:chamber_store.ChamberStore is given, the chamber is memoized in it.
     """
+    if store is not None:
+        return store.chamber( user, edgelist, users_excluded )
+    if isinstance( edgelist, RetweetGraph ):
+        return get_chamber_from_graph( user, edgelist, users_excluded=users_excluded )
     
     audience = get_audience( user, edgelist, source=source, target=target )
     audience_out_ego_network = edgelist[ edgelist[ source ].isin( audience ) ]
@@ -140,6 +244,8 @@ def get_chamber_from_audience(user, edgelist, audience, users_excluded=False, so
 
     users_excluded can be either False or a list of users to exclude from chamber.
     """
+    if isinstance( edgelist, RetweetGraph ):
+        return chamber_from_audience_codes( user, edgelist, edgelist.encode( audience ), users_excluded=users_excluded )
 
     audience_out_ego_network = edgelist[ edgelist[ source ].isin( audience ) ]
     # remove the leading user from the audience ego network
@@ -152,49 +258,155 @@ def get_chamber_from_audience(user, edgelist, audience, users_excluded=False, so
     chamber = set( audience_out_ego_network[ target ].unique() )
     return chamber
 
-def get_audience_edgelist( user, edgelist, source='source', target='target' ):
+def get_audience_edgelist( user, edgelist, source='source', target='target', store=None ):
     '''Builds audience network of leading user `user`.
+    If store:chamber_store.ChamberStore is given, the network is built by the store (its audiences can be arrays of user IDs).
     ''' 
 
-    audience = get_audience( user, edgelist, source, target )
+    if store is not None:
+        store.check_arguments( source, target )
+        return store.audience_edgelist( user, edgelist )
+
+    audience = get_audience( user, edgelist, source, target, store=store )
 
     audience_edgelist = get_edgelist_from_audience( audience, edgelist, source, target ) 
     return audience_edgelist
 
 
-def get_chamber_edgelist( user, edgelist, users_excluded=False, source='source', target='target'):
+def get_chamber_edgelist( user, edgelist, users_excluded=False, source='source', target='target', store=None):
     '''Builds chamber network of leading user `user`.
+    If store:chamber_store.ChamberStore is given, the network is built by the store (its chambers can be arrays of user IDs).
     ''' 
 
-    chamber = get_chamber( user, edgelist, users_excluded, source, target )
+    if store is not None:
+        store.check_arguments( source, target )
+        return store.chamber_edgelist( user, edgelist, users_excluded )
+
+    chamber = get_chamber( user, edgelist, users_excluded, source, target, store=store )
 
     chamber_edgelist = get_edgelist_from_chamber( chamber, edgelist, source, target ) 
     return chamber_edgelist
 
-# helper
+# helpers (chamber/audience can be sets of users or, for graphs with global IDs, arrays of user IDs)
 def get_edgelist_from_chamber(chamber, edgelist, source='source', target='target'):
+    if isinstance( edgelist, RetweetGraph ):
+        return edgelist.to_edgelist( edgelist.edges_among( edgelist.encode( chamber ) ), source=source, target=target )
+
     chamber_edgelist = edgelist[ (edgelist[ source ].isin( chamber )) & (edgelist[ target ].isin( chamber )) ]
     return chamber_edgelist
 
 def get_edgelist_from_audience(audience, edgelist, source='source', target='target'):
+    if isinstance( edgelist, RetweetGraph ):
+        return edgelist.to_edgelist( edgelist.edges_among( edgelist.encode( audience ) ), source=source, target=target )
+
     audience_edgelist = edgelist[ (edgelist[ source ].isin( audience )) & (edgelist[ target ].isin( audience )) ]
     return audience_edgelist
 
 
-def get_chambers_of_users( users, edgelist, users_excluded=False, source='source', target='target', return_network=False ):
+## RETWEET GRAPH (CSR) VARIANTS
+# If the graph was built with a global UserDictionary (user_ids), sets of users are returned as sorted arrays of user IDs.
+def get_audience_from_graph( user, graph ):
+    '''Returns the audience:set of the user given a RetweetGraph. O(in-degree).
+    '''
+    code = graph.code( user )
+    if code < 0:
+        return graph.decode( np.zeros( 0, dtype=np.int32 ) )
+
+    return graph.decode( graph.in_neighbours( [ code ] ) )
+
+def get_chamber_from_graph( user, graph, users_excluded=False ):
+    """Returns the chamber:set of the user given a RetweetGraph. O(sum of the audience out-degrees).
+
+    users_excluded can be either False or a list of users to exclude from chamber.
+    """
+    code = graph.code( user )
+    if code < 0:
+        return graph.decode( np.zeros( 0, dtype=np.int32 ) )
+
+    audience = graph.in_neighbours( [ code ] )
+    return chamber_from_audience_codes( user, graph, audience, users_excluded=users_excluded )
+
+def chamber_from_audience_codes( user, graph, audience, users_excluded=False ):
+    """Returns the chamber:set of the user given a RetweetGraph and the int codes of its audience.
+    """
+
+    chamber = graph.out_neighbours( audience )
+    # remove the leading user from the audience ego network
+    chamber = chamber[ chamber != graph.code( user ) ]
+
+    # exclude specific users from chamber.
+    if users_excluded is not False:
+        chamber = chamber[ ~np.isin( chamber, graph.encode( users_excluded ) ) ]
+
+    return graph.decode( chamber )
+
+
+def get_chambers_batched( users, edgelist, users_excluded=False, source='source', target='target', user_ids=None ):
+    """Get the chamber of all the users in `users` with a single sparse matrix product.
+
+    The (users x all users) audience indicator matrix R is multiplied by the adjacency matrix A, so that the chamber of user i
+    is the nonzero pattern of the i-th row of R @ A once the user itself and users_excluded are masked out.
+    edgelist can be a dataframe or a RetweetGraph. users_excluded can be either False or a list of users to exclude from chambers.
+    If user_ids:UserDictionary is given, the chambers are sorted arrays of global user IDs.
+    """
+
+    graph = as_retweet_graph( edgelist, source=source, target=target, user_ids=user_ids )
+    users = list( users )
+
+    codes = np.array( [ graph.code( user ) for user in users ], dtype=np.int64 )
+    in_graph = codes >= 0
+    codes[ ~in_graph ] = 0
+
+    A = graph.adjacency_matrix()
+    # row i of R is the audience indicator of users[i]; users missing from the graph get an empty row
+    R = A.T.tocsr()[ codes ]
+    R = R.multiply( in_graph[:, None] ).tocsr()
+
+    C = ( R @ A ).tocsr()
+    C.eliminate_zeros()
+
+    # column masks: the leading user itself and the excluded users
+    rows = np.repeat( np.arange( len(users) ), np.diff( C.indptr ) )
+    keep = C.indices != codes[ rows ]
+    if users_excluded is not False:
+        excluded = np.zeros( graph.num_users, dtype=bool )
+        excluded[ graph.encode( users_excluded ) ] = True
+        keep &= ~excluded[ C.indices ]
+
+    splits = np.cumsum( np.bincount( rows[ keep ], minlength=len(users) ) )[:-1]
+
+    return { user: graph.decode( chamber ) for ( user, chamber ) in zip( users, np.split( C.indices[ keep ], splits ) ) }
+
+def get_chambers_of_users( users, edgelist, users_excluded=False, source='source', target='target', return_network=False, batched=False, user_ids=None, views=False ):
     """Get the chamber of all the users in `users`.
 
     users_excluded can be {False, list:str (list of global excluded users), list:list:str (list of excluded users per week)}
+    edgelist can be a dataframe or a RetweetGraph; build the graph once per week (retweet_graph.build_retweet_graph) to avoid a full edgelist scan per user.
+    If batched, all the chambers are computed at once with a sparse matrix product (see get_chambers_batched).
+    If user_ids:UserDictionary is given, the chambers are sorted arrays of global user IDs.
+    If return_network and views, the chamber networks are zero-copy retweet_graph.SubNetworkView's instead of dataframes.
     """
 
+    if (user_ids is not None) or (return_network and views):
+        edgelist = as_retweet_graph( edgelist, source=source, target=target, user_ids=user_ids )
+
+    if batched:
+        edgelist = as_retweet_graph( edgelist, source=source, target=target )
+        batched_chambers = get_chambers_batched( users, edgelist, users_excluded=users_excluded )
+
     chambers_dict = {}
     chamber_networks_dict = {}
     for i, user in enumerate(users):
 
-        chamber = get_chamber( user, edgelist, users_excluded=users_excluded, source=source, target=target )
+        if batched:
+            chamber = batched_chambers[user]
+        else:
+            chamber = get_chamber( user, edgelist, users_excluded=users_excluded, source=source, target=target )
         chambers_dict[user] = chamber
 
-        if return_network:
+        if return_network and views:
+            chamber_networks_dict[user] = edgelist.subnetwork( edgelist.encode( chamber ) )
+        elif return_network:
             chamber_edgelist = get_edgelist_from_chamber( chamber, edgelist, source, target )
             chamber_networks_dict[user] = chamber_edgelist
 
@@ -204,12 +416,17 @@ def get_chambers_of_users( users, edgelist, users_excluded=False, source='source
     else:
         return chambers_dict
 
-def get_audiences_of_users( users, edgelist, source='source', target='target', return_network=False ):
+def get_audiences_of_users( users, edgelist, source='source', target='target', return_network=False, user_ids=None, views=False ):
     """Get the audience of all the users in `users`.
 
-    users_excluded can be {False, list:str (list of global excluded users), list:list:str (list of excluded users per week)}
+    edgelist can be a dataframe or a RetweetGraph (see get_chambers_of_users).
+    If user_ids:UserDictionary is given, the audiences are sorted arrays of global user IDs.
+    If return_network and views, the audience networks are zero-copy retweet_graph.SubNetworkView's instead of dataframes.
     """
 
+    if (user_ids is not None) or (return_network and views):
+        edgelist = as_retweet_graph( edgelist, source=source, target=target, user_ids=user_ids )
+
     audiences_dict = {}
     audience_networks_dict = {}
     for i, user in enumerate(users):
@@ -217,7 +434,9 @@ def get_audiences_of_users( users, edgelist, source='source', target='target', r
         audience = get_audience( user, edgelist, source=source, target=target )
         audiences_dict[user] = audience
 
-        if return_network:
+        if return_network and views:
+            audience_networks_dict[user] = edgelist.subnetwork( edgelist.encode( audience ) )
+        elif return_network:
             audience_edgelist = get_edgelist_from_audience( audience, edgelist, source, target )
             audience_networks_dict[user] = audience_edgelist
 
@@ -227,10 +446,21 @@ def get_audiences_of_users( users, edgelist, source='source', target='target', r
     else:
         return audiences_dict
 
-def temporal_chambers(users, edgelists, users_excluded=False, source='source', target='target', return_networks=False): 
+def temporal_chambers(users, edgelists, users_excluded=False, source='source', target='target', return_networks=False, batched=False, n_jobs=None, executor=None, user_ids=None, store=None, views=False): 
     """Get the chambers of all the users in users for every edgelist in edgelists. It is assumed that edgelists are ordered temporally.
+    If batched, the chambers of each week are computed with one sparse matrix product (see get_chambers_batched).
+    If n_jobs or executor are given, the weeks are processed in parallel over a process pool (see weekly_pool.map_weeks).
+    If user_ids:UserDictionary is given, the chambers are sorted arrays of global user IDs.
+    If store:chamber_store.ChamberStore is given, the chambers are memoized in it (in this process; user_ids are those of the store)
+    and the chamber networks are only built when accessed. Raises ValueError if n_jobs, executor, source, target or user_ids
+    conflict with the store.
+    If views, the chamber networks are zero-copy views over the week's edge arrays (see get_chambers_of_users).
     """
 
+    if store is not None:
+        store.check_arguments( source, target, user_ids, n_jobs, executor )
+        return store.temporal_chambers( users, edgelists, users_excluded, return_networks, batched, views )
+
     # preallocation
     temporal_chambers_vec = [{}] * len(edgelists)
     temporal_chamber_networks_vec = [{}] * len(edgelists)
@@ -240,22 +470,31 @@ def temporal_chambers(users, edgelists, users_excluded=False, source='source', t
     if users_excluded != False:
         list_of_lists = (type(users_excluded[0]) == list) | (type(users_excluded[0]) == set)
 
-    for (t,edgelist) in enumerate(edgelists): 
+    week_args = []
+    for t in range( len(edgelists) ):
+        if list_of_lists:
+            week_args.append( ( users[t], users_excluded[t], source, target, return_networks, batched, views ) )
+        else:
+            week_args.append( ( users[t], users_excluded, source, target, return_networks, batched, views ) )
+
+    if (n_jobs is not None) or (executor is not None):
+        if return_networks and views:
+            # the views come back without their graph, they are attached to the graphs of this process
+            edgelists = [ as_retweet_graph( edgelist, source=source, target=target, user_ids=user_ids ) for edgelist in edgelists ]
+        weekly_results = wp.map_weeks( _chambers_of_week, edgelists, week_args, n_jobs=n_jobs, executor=executor, source=source, target=target, user_ids=user_ids )
+        if return_networks and views:
+            weekly_results = [ _bind_views( result, edgelists[t] ) for (t,result) in enumerate( weekly_results ) ]
+    else:
+        weekly_results = ( _chambers_of_week( _as_week_graph( edgelist, source, target, user_ids ), *week_args[t] ) for (t,edgelist) in enumerate(edgelists) )
+
+    for (t,result) in enumerate(weekly_results): 
         
         if return_networks:
-            if list_of_lists:
-                chamber_per_user_dict, chamber_network_per_user_dict = get_chambers_of_users( users[t], edgelist, users_excluded[t], source, target, return_networks )
-            else:
-                chamber_per_user_dict, chamber_network_per_user_dict = get_chambers_of_users( users[t], edgelist, users_excluded, source, target, return_networks )
-
+            chamber_per_user_dict, chamber_network_per_user_dict = result
             # append chamber networks for time t
             temporal_chamber_networks_vec[t] = chamber_network_per_user_dict
-
         else:
-            if list_of_lists:
-                chamber_per_user_dict = get_chambers_of_users( users[t], edgelist, users_excluded[t], source, target, return_networks )
-            else:
-                chamber_per_user_dict = get_chambers_of_users( users[t], edgelist, users_excluded, source, target, return_networks )
+            chamber_per_user_dict = result
         
         # append chambers for time t 
         temporal_chambers_vec[t] = chamber_per_user_dict
@@ -265,23 +504,41 @@ def temporal_chambers(users, edgelists, users_excluded=False, source='source', t
     else:
         return temporal_chambers_vec
 
-def temporal_audiences( users, edgelists, source='source', target='target', return_networks=False ):
+def temporal_audiences( users, edgelists, source='source', target='target', return_networks=False, n_jobs=None, executor=None, user_ids=None, store=None, views=False ):
     """Get the audiences of all the users in users for every edgelist in edgelists. It is assumed that edgelists are ordered temporally.
+    If n_jobs or executor are given, the weeks are processed in parallel over a process pool (see weekly_pool.map_weeks).
+    If user_ids:UserDictionary is given, the audiences are sorted arrays of global user IDs.
+    If store:chamber_store.ChamberStore is given, the audiences are memoized in it (see temporal_chambers).
+    If views, the audience networks are zero-copy views over the week's edge arrays (see get_audiences_of_users).
     """
 
+    if store is not None:
+        store.check_arguments( source, target, user_ids, n_jobs, executor )
+        return store.temporal_audiences( users, edgelists, return_networks, views )
+
     # preallocation
     temporal_audiences_vec = [{}] * len(edgelists)
     temporal_audience_networks_vec = [{}] * len(edgelists)
 
-    for (t,edgelist) in enumerate(edgelists): 
+    week_args = [ ( users[t], source, target, return_networks, views ) for t in range( len(edgelists) ) ]
+
+    if (n_jobs is not None) or (executor is not None):
+        if return_networks and views:
+            edgelists = [ as_retweet_graph( edgelist, source=source, target=target, user_ids=user_ids ) for edgelist in edgelists ]
+        weekly_results = wp.map_weeks( _audiences_of_week, edgelists, week_args, n_jobs=n_jobs, executor=executor, source=source, target=target, user_ids=user_ids )
+        if return_networks and views:
+            weekly_results = [ _bind_views( result, edgelists[t] ) for (t,result) in enumerate( weekly_results ) ]
+    else:
+        weekly_results = ( _audiences_of_week( _as_week_graph( edgelist, source, target, user_ids ), *week_args[t] ) for (t,edgelist) in enumerate(edgelists) )
+
+    for (t,result) in enumerate(weekly_results): 
         
         if return_networks:
-            audience_per_user_dict, audience_network_per_user_dict = get_audiences_of_users( users[t], edgelist, source, target, return_networks )
+            audience_per_user_dict, audience_network_per_user_dict = result
             # append audience networks for time t
             temporal_audience_networks_vec[t] = audience_network_per_user_dict
-
         else:
-            audience_per_user_dict = get_audiences_of_users( users[t], edgelist, source, target, return_networks )
+            audience_per_user_dict = result
         
         # append audiences for time t 
         temporal_audiences_vec[t] = audience_per_user_dict
@@ -291,12 +548,32 @@ def temporal_audiences( users, edgelists, source='source', target='target', retu
     else:
         return temporal_audiences_vec
 
+# helpers (top-level so they can be sent to worker processes)
+def _chambers_of_week( edgelist, users, users_excluded, source, target, return_networks, batched, views=False ):
+    return get_chambers_of_users( users, edgelist, users_excluded, source, target, return_networks, batched, views=views )
+
+def _audiences_of_week( edgelist, users, source, target, return_networks, views=False ):
+    return get_audiences_of_users( users, edgelist, source, target, return_networks, views=views )
+
+def _bind_views( result, graph ):
+    sets_dict, views_dict = result
+    for view in views_dict.values():
+        view.bind( graph )
+    return sets_dict, views_dict
+
+def _as_week_graph( edgelist, source, target, user_ids ):
+    if user_ids is None:
+        return edgelist
+    return as_retweet_graph( edgelist, source=source, target=target, user_ids=user_ids )
+
 # helper
 def get_chamber_from_audience(user, edgelist, audience, users_excluded=False, source='source', target='target'):
     """Returns the chamber:set of the user given an edgelist and a given audience.
 
     users_excluded can be either False or a list of users to exclude from chamber.
     """
+    if isinstance( edgelist, RetweetGraph ):
+        return chamber_from_audience_codes( user, edgelist, edgelist.encode( audience ), users_excluded=users_excluded )
 
     audience_out_ego_network = edgelist[ edgelist[ source ].isin( audience ) ]
     # remove the leading user from the audience ego network
@@ -1,38 +1,341 @@
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import laplacian as sparse_laplacian
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse.linalg import eigsh, lobpcg, ArpackNoConvergence
 
 # Example names
 COMMUNITY_1 = 'The foos'
 COMMUNITY_2 = 'The bars'
 
-def communities_spectral( Q, mode=3, cutoff=0, return_spectra=False ):
-    '''Unsupervised community detection based on the spectral clustering of the Laplacian of the similarity matrix Q.'''
+def communities_spectral( Q, mode=3, cutoff=0, return_spectra=False, sparse=False, normalized=False, users=None ):
+    '''Unsupervised community detection based on the spectral clustering of the Laplacian of the similarity matrix Q.
+
+    If Q is a scipy.sparse matrix (with the names of its users in `users`) or sparse=True, the symmetric sparse path is used:
+    only the `mode` smallest eigenpairs of the (optionally normalized) Laplacian are computed with a Lanczos solver, and
+    eigenvalues are sorted in ascending order.
+    '''
+
+    if sparse or sp.issparse( Q ):
+        return communities_spectral_sparse( Q, mode=mode, cutoff=cutoff, return_spectra=return_spectra, normalized=normalized, users=users )
 
     L = laplacian_matrix( Q.replace(np.nan,0) )
     eigvals, eigvecs = np.linalg.eig(L)
 
     leading_eigvec = eigvecs[:,mode-1]
-    users_ordering = np.argsort( leading_eigvec )
+    P_spectral = partition_from_eigvec( leading_eigvec, Q.index.values, cutoff=cutoff )
+
+    if return_spectra:
+        return P_spectral, (eigvals, eigvecs)
+    else:
+        return P_spectral
+
+def communities_spectral_sparse( Q, mode=3, cutoff=0, return_spectra=False, normalized=False, users=None ):
+    '''Sparse symmetric version of communities_spectral. Q can be a scipy.sparse matrix or a dataframe.
+    Only the `mode` smallest eigenpairs are computed, so this scales to tens of thousands of users.
+    '''
+
+    W, users = similarity_to_sparse( Q, users=users )
+
+    L = laplacian_matrix_sparse( W, normalized=normalized )
+    eigvals, eigvecs = smallest_eigenpairs( L, mode )
+
+    P_spectral = partition_from_eigvec( eigvecs[:,mode-1], users, cutoff=cutoff )
+
+    if return_spectra:
+        return P_spectral, (eigvals, eigvecs)
+    else:
+        return P_spectral
+
+def communities_spectral_kway( Q, k, normalized=False, users=None, return_embedding=False, community_names=None, spectra=None, n_init=10, max_iter=100, random_state=0 ):
+    '''k-way spectral partition of the users of the similarity matrix Q (dataframe or scipy.sparse matrix with `users`).
+    Users are embedded on the first k nontrivial eigenvectors of the Laplacian (rows normalized to unit length if normalized)
+    and clustered with k-means. Communities are named community_names[i] (default: i), in decreasing order of size.
+
+    spectra=(eigvals, eigvecs) with at least k+1 smallest eigenpairs (as returned with return_embedding) can be passed to
+    skip the eigensolver, see communities_spectral_sweep.
+
+    Returns P_kway:dict{user:community} (and the n_users x k embedding if return_embedding).
+    '''
+
+    if community_names is not None and len( community_names ) < k:
+        raise ValueError( "{} community_names given for {} communities".format( len( community_names ), k ) )
+
+    W, users = similarity_to_sparse( Q, users=users )
+
+    if spectra is None:
+        spectra = smallest_eigenpairs( laplacian_matrix_sparse( W, normalized=normalized ), k+1 )
+    eigvals, eigvecs = spectra
+
+    embedding = spectral_embedding( eigvecs, k, normalized=normalized )
+    labels, _, _ = kmeans( embedding, k, n_init=n_init, max_iter=max_iter, random_state=random_state )
+    P_kway = partition_from_labels( labels, users, community_names=community_names )
+
+    if return_embedding:
+        return P_kway, embedding
+    else:
+        return P_kway
+
+def communities_spectral_sweep( Q, ks, normalized=False, users=None, **kmeans_kw ):
+    '''Returns {k: P_kway} for every k in ks. The eigensolver runs once, for the max(ks)+1 smallest eigenpairs.
+    '''
+
+    W, users = similarity_to_sparse( Q, users=users )
+    spectra = smallest_eigenpairs( laplacian_matrix_sparse( W, normalized=normalized ), max( ks )+1 )
+
+    return { k: communities_spectral_kway( W, k, normalized=normalized, users=users, spectra=spectra, **kmeans_kw ) for k in ks }
+
+def temporal_communities_spectral( similarity_matrices, k=2, normalized=False, users=None, warm_start=True, tol=1e-6, maxiter=500, return_iterations=False, **kmeans_kw ):
+    '''k-way spectral communities (see communities_spectral_kway) of every week of similarity_matrices:list[dataframe]
+    (e.g. the output of similarity_metrics.temporal_similarity_matrices), tracked across weeks.
+
+    The eigensolver of every week (LOBPCG) is warm-started from the eigenvectors of the previous week on the users they share.
+    Eigenvector signs are aligned with the previous week, and community labels are matched to those of the previous week by
+    maximum overlap of their common users (Hungarian assignment), so labels are comparable across weeks.
+
+    Returns (membership, users), where membership:int array(weeks x users) holds the community of every user in users (the union
+    of the users of all the weeks in order of appearance, if None) and -1 for users absent that week. Raises ValueError if users is given and
+    misses users of some week.
+    If return_iterations, also returns the number of solver iterations of every week.
+    '''
+
+    if users is None:
+        users = pd.unique( np.concatenate( [ np.asarray( Q.index.values, dtype=object ) for Q in similarity_matrices ] ) )
+    users = np.asarray( users, dtype=object )
+    user_index = pd.Index( users )
+
+    membership = np.full( ( len(similarity_matrices), len(users) ), -1, dtype=int )
+    iterations = []
+
+    prev_codes, prev_eigvecs, prev_labels = None, None, None
+    for t, Q in enumerate( similarity_matrices ):
+
+        W, week_users = similarity_to_sparse( Q )
+        codes = user_index.get_indexer( week_users )
+        if ( codes < 0 ).any():
+            raise ValueError( 'users of week {} are missing from users: {}'.format( t, list( week_users[ codes < 0 ][:5] ) ) )
+        L = laplacian_matrix_sparse( W, normalized=normalized )
+
+        X = None
+        if warm_start and prev_eigvecs is not None:
+            X = _warm_start_vectors( codes, prev_codes, prev_eigvecs )
+
+        eigvals, eigvecs, n_iter = smallest_eigenpairs_lobpcg( L, k+1, X=X, tol=tol, maxiter=maxiter )
+        iterations.append( n_iter )
+
+        if prev_eigvecs is not None:
+            eigvecs = _align_signs( eigvecs, codes, prev_eigvecs, prev_codes )
+
+        embedding = spectral_embedding( eigvecs, k, normalized=normalized )
+        labels, _, _ = kmeans( embedding, k, **kmeans_kw )
+
+        if prev_labels is None:
+            # name communities in decreasing order of size, as in communities_spectral_kway
+            labels = _rank_by_size( labels, k )
+        else:
+            labels = _align_labels( labels, codes, prev_labels, prev_codes, k )
+
+        membership[ t, codes ] = labels
+        prev_codes, prev_eigvecs, prev_labels = codes, eigvecs, labels
+
+    if return_iterations:
+        return membership, users, iterations
+    else:
+        return membership, users
+
+def smallest_eigenpairs_lobpcg( L, k, X=None, tol=1e-6, maxiter=500, random_state=0 ):
+    '''Returns the k smallest eigenvalues (ascending), eigenvectors and the number of iterations of LOBPCG on the sparse
+    Laplacian L, started from the n x k block X (random if None) and preconditioned with the inverse of the diagonal of L.
+    Falls back to smallest_eigenpairs (0 iterations) if L is too small for LOBPCG.
+    '''
+
+    n = L.shape[0]
+    if n < 5*k:
+        eigvals, eigvecs = smallest_eigenpairs( L, k )
+        return eigvals, eigvecs, 0
+
+    if X is None:
+        X = np.random.default_rng( random_state ).random( ( n, k ) )
+
+    diag = L.diagonal()
+    M = sp.diags( np.where( diag > 0, 1 / np.where( diag > 0, diag, 1 ), 1 ) )
 
-    users = Q.index.values[users_ordering]
+    eigvals, eigvecs, residuals = lobpcg( L, X, M=M, largest=False, tol=tol, maxiter=maxiter, retResidualNormsHistory=True )
+    order = np.argsort( eigvals )
+    return eigvals[order], eigvecs[:,order], len( residuals )
+
+def smallest_eigenpairs( L, k, v0=None, sigma=None, tol=0, maxiter=None ):
+    '''Returns the k smallest eigenvalues (ascending) and eigenvectors of the symmetric positive semi-definite sparse matrix L.
+    Uses the Lanczos solver (eigsh) on the largest end of the spectrum of lmax*I - L, where lmax >= the largest eigenvalue
+    of L (Gershgorin bound), so only sparse mat-vecs are needed and the wanted eigenvalues are the best separated ones.
+    With sigma (e.g. -1e-3), eigsh runs in shift-invert mode around sigma instead: fewer iterations, but a sparse LU of L.
+    Falls back to LOBPCG (smallest_eigenpairs_lobpcg) if ARPACK does not converge within maxiter iterations.
+    '''
+
+    n = L.shape[0]
+    if k >= n - 1:
+        # too small for Lanczos
+        return _dense_eigenpairs( L, k )
+
+    if v0 is None:
+        # fixed starting vector, so that signs of the eigenvectors are reproducible
+        v0 = np.random.default_rng( 0 ).random( n )
+
+    try:
+        if sigma is not None:
+            eigvals, eigvecs = eigsh( L, k=k, sigma=sigma, which='LM', v0=v0, tol=tol, maxiter=maxiter )
+        else:
+            lmax = abs( L ).sum( axis=1 ).max()
+            eigvals, eigvecs = eigsh( lmax*sp.identity( n, format='csr' ) - L, k=k, which='LA', v0=v0, tol=tol, maxiter=maxiter )
+            eigvals = lmax - eigvals
+
+    except ArpackNoConvergence:
+        if n < 5*k:
+            return _dense_eigenpairs( L, k )
+        eigvals, eigvecs, _ = smallest_eigenpairs_lobpcg( L, k, tol=max( tol, 1e-6 ) )
+
+    order = np.argsort( eigvals )
+    return eigvals[order], eigvecs[:,order]
+
+def partition_from_eigvec( eigvec, users, cutoff=0 ):
+    '''Splits users by the sign of eigvec:array (with respect to cutoff) into COMMUNITY_1, COMMUNITY_2 (and 'other' if == cutoff).
+    Users are ordered by their eigvec entry.
+    '''
+
+    users_ordering = np.argsort( eigvec )
+    users = np.asarray( users )[users_ordering]
 
     P_spectral = dict()
-    for i,u in enumerate( leading_eigvec[users_ordering] ):
-        
+    for i,u in enumerate( eigvec[users_ordering] ):
+
         user = users[i]
         if u > cutoff:
-            P_spectral[user] = COMMUNITY_1 
+            P_spectral[user] = COMMUNITY_1
         elif u < cutoff:
             P_spectral[user] = COMMUNITY_2
         else:
             P_spectral[user] = 'other'
 
-    if return_spectra:
-        return P_spectral, (eigvals, eigvecs)
-    else:
-        return P_spectral
+    return P_spectral
+
+def spectral_embedding( eigvecs, k, normalized=False ):
+    '''Returns the n x k embedding on the first k nontrivial eigenvectors, with rows normalized to unit length if normalized.
+    '''
+
+    # drop the trivial eigenvector
+    embedding = eigvecs[:,1:k+1]
+    if normalized:
+        norms = np.linalg.norm( embedding, axis=1, keepdims=True )
+        embedding = embedding / np.where( norms > 0, norms, 1 )
+
+    return embedding
+
+def partition_from_labels( labels, users, community_names=None ):
+    '''Returns the partition dict{user:community} of cluster labels:int array, with clusters renamed in decreasing order of size.
+    '''
+
+    k = labels.max()+1
+    if community_names is not None and len( community_names ) < k:
+        raise ValueError( "{} community_names given for {} communities".format( len( community_names ), k ) )
+
+    labels = _rank_by_size( labels, k )
+
+    names = np.arange( k ) if community_names is None else np.asarray( community_names, dtype=object )
+    return dict( zip( np.asarray( users ).tolist(), names[ labels ].tolist() ) )
+
+###################### K-MEANS ######################
+def kmeans( X, k, n_init=10, max_iter=100, tol=1e-6, random_state=0 ):
+    '''Vectorized Lloyd's k-means of the rows of X:array(n x d) with k-means++ initialisation and n_init restarts.
+    Returns (labels, centroids, inertia) of the restart with the lowest inertia.
+    '''
+
+    rng = np.random.default_rng( random_state )
+    X = np.asarray( X, dtype=float )
+    X_sq = ( X**2 ).sum( axis=1 )
+
+    best = None
+    for _ in range( n_init ):
+        centroids = _kmeans_plusplus( X, X_sq, k, rng )
+
+        for _ in range( max_iter ):
+            labels, dists = _closest_centroids( X, X_sq, centroids )
+
+            # mean of every cluster, keeping the previous centroid for empty clusters
+            counts = np.bincount( labels, minlength=k )
+            sums = np.zeros_like( centroids )
+            np.add.at( sums, labels, X )
+            new_centroids = np.where( counts[:,None] > 0, sums / np.maximum( counts, 1 )[:,None], centroids )
+
+            shift = ( ( new_centroids - centroids )**2 ).sum()
+            centroids = new_centroids
+            if shift <= tol:
+                break
+
+        labels, dists = _closest_centroids( X, X_sq, centroids )
+        inertia = dists.sum()
+        if best is None or inertia < best[2]:
+            best = ( labels, centroids, inertia )
+
+    return best
+
+def _kmeans_plusplus( X, X_sq, k, rng ):
+    centroids = np.empty( ( k, X.shape[1] ) )
+    centroids[0] = X[ rng.integers( len(X) ) ]
+
+    min_dists = np.maximum( X_sq - 2 * X @ centroids[0] + centroids[0] @ centroids[0], 0 )
+    for i in range( 1, k ):
+        total = min_dists.sum()
+        j = rng.choice( len(X), p=min_dists/total ) if total > 0 else rng.integers( len(X) )
+        centroids[i] = X[ j ]
+        min_dists = np.minimum( min_dists, np.maximum( X_sq - 2 * X @ centroids[i] + centroids[i] @ centroids[i], 0 ) )
+
+    return centroids
+
+def _closest_centroids( X, X_sq, centroids ):
+    # squared distances |x|^2 - 2 x.c + |c|^2 of every row to every centroid
+    dists = X_sq[:,None] - 2 * X @ centroids.T + ( centroids**2 ).sum( axis=1 )[None,:]
+    labels = dists.argmin( axis=1 )
+    return labels, np.maximum( dists[ np.arange( len(X) ), labels ], 0 )
 
 ## Helpers
+def _dense_eigenpairs( L, k ):
+    eigvals, eigvecs = np.linalg.eigh( L.toarray() )
+    return eigvals[:k], eigvecs[:,:k]
+
+def _rank_by_size( labels, k ):
+    # relabel clusters 0..k-1 in decreasing order of size
+    order = np.argsort( -np.bincount( labels, minlength=k ), kind='stable' )
+    rank = np.empty_like( order )
+    rank[ order ] = np.arange( k )
+    return rank[ labels ]
+
+def _warm_start_vectors( codes, prev_codes, prev_eigvecs ):
+    # previous eigenvectors on the users of this week, random entries for the new users
+    X = np.random.default_rng( 0 ).random( ( len(codes), prev_eigvecs.shape[1] ) ) * 1e-3
+
+    prev_rows = pd.Index( prev_codes ).get_indexer( codes )
+    common = prev_rows >= 0
+    X[ common ] = prev_eigvecs[ prev_rows[ common ] ]
+    return X
+
+def _align_signs( eigvecs, codes, prev_eigvecs, prev_codes ):
+    # flip every eigenvector that points away from the previous week's one on the common users
+    common, rows, prev_rows = np.intersect1d( codes, prev_codes, return_indices=True )
+    signs = np.sign( ( eigvecs[ rows ] * prev_eigvecs[ prev_rows ] ).sum( axis=0 ) )
+    return eigvecs * np.where( signs < 0, -1, 1 )
+
+def _align_labels( labels, codes, prev_labels, prev_codes, k ):
+    # relabel communities to maximise the number of common users keeping their previous label
+    common, rows, prev_rows = np.intersect1d( codes, prev_codes, return_indices=True )
+    overlaps = np.zeros( ( k, k ), dtype=int )
+    np.add.at( overlaps, ( labels[ rows ], prev_labels[ prev_rows ] ), 1 )
+
+    current, previous = linear_sum_assignment( -overlaps )
+    relabel = np.empty( k, dtype=int )
+    relabel[ current ] = previous
+    return relabel[ labels ]
+
 def laplacian_matrix( Q ):
     '''Returns the names Laplacian matrix of Q.
         input: A:dataframe where index==columns:names of users
@@ -40,13 +343,34 @@ def laplacian_matrix( Q ):
 
     # degree vector
     D = Q.sum(axis=1)
-    D = pd.DataFrame( 
-            np.diag(D),
-            index=D.index,
-            columns=D.index
-            )
 
-    return D - Q
+    # D - Q without building the dense diagonal matrix of degrees
+    L = -Q.values.astype( float )
+    L[ np.diag_indices_from( L ) ] += D.values
+
+    return pd.DataFrame( L, index=D.index, columns=D.index )
+
+def laplacian_matrix_sparse( W, normalized=False ):
+    '''Returns the sparse (csr) Laplacian D - W of the sparse similarity matrix W, or I - D^(-1/2) W D^(-1/2) if normalized.
+    '''
+    return sp.csr_matrix( sparse_laplacian( W, normed=normalized ) )
+
+def similarity_to_sparse( Q, users=None ):
+    '''Returns the symmetric sparse (csr) similarity matrix of Q (dataframe or sparse matrix) without NaNs, and the names of its users.
+    '''
+
+    if sp.issparse( Q ):
+        W = sp.csr_matrix( Q, dtype=float, copy=True )
+        if users is None:
+            users = np.arange( W.shape[0] )
+    else:
+        users = Q.index.values if users is None else users
+        W = sp.csr_matrix( np.nan_to_num( Q.values.astype( float ) ) )
+
+    W.data = np.nan_to_num( W.data )
+    W.eliminate_zeros()
+
+    return W, np.asarray( users )
 
 def spectrum( L ):
-    return np.linalg.eig(L) 
\ No newline at end of file
+    return np.linalg.eig(L)
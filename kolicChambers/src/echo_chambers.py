@@ -1,4 +1,10 @@
-def echo_chambers_dynamics(audiences, chambers, partition):
+import numpy as np
+import pandas as pd
+# local
+import set_backends as sb
+import similarity_metrics as sm
+
+def echo_chambers_dynamics(audiences, chambers, partition, backend=None):
     '''Returns the weekly echo chambers (union of all audiences and chambers) for all the groups in partition:dict.
     '''
     
@@ -10,31 +16,37 @@ def echo_chambers_dynamics(audiences, chambers, partition):
         chamber = chambers[t]
         audience = audiences[t]
         
-        echo_chambers.append( get_echo_chambers(audience, chamber, partition) )
+        echo_chambers.append( get_echo_chambers(audience, chamber, partition, backend=backend) )
         
     return echo_chambers
     
-def get_echo_chambers(audience, chamber, partition):
+def get_echo_chambers(audience, chamber, partition, backend=None):
     '''Returns the echo chamber (union of audience and chamber) according to the groups in partition.
-    The chamber (audience) is a dict of the form user:chamber(audience)
+    The chamber (audience) is a dict of the form user:chamber(audience), with sets of users, ID arrays or bitmaps (see set_backends).
+    If backend is given ('python', 'array' or 'roaring'), the audiences and chambers are converted to it; otherwise it is inferred.
     '''
 
     assert chamber.keys() == audience.keys(), "the users in the chambers are not the same that those in the audiences"
+
+    if backend is None:
+        backend = sb.backend_of( next( iter( chamber.values() ) ) ) if len(chamber) > 0 else 'python'
     
     ideological_groups = set( partition.values() ) 
     
-    # echo_audience = dict()
-    echo_chamber = dict()
+    # members of every group, united once at the end instead of copying the whole set on every union
+    echo_members = dict()
     for group in ideological_groups:
-        # echo_audience[group] = set()
-        echo_chamber[group] = set()
+        echo_members[group] = []
     
     for user in chamber.keys():
         
-        # echo_audience[ partition[user] ] = echo_audience[ partition[user] ].union( audience[user] )
-        echo_chamber[ partition[user] ] = echo_chamber[ partition[user] ].union( audience[user] )
-        echo_chamber[ partition[user] ] = echo_chamber[ partition[user] ].union( chamber[user] )
+        echo_members[ partition[user] ].append( sb.to_backend( audience[user], backend ) )
+        echo_members[ partition[user] ].append( sb.to_backend( chamber[user], backend ) )
     
+    echo_chamber = dict()
+    for group in ideological_groups:
+        echo_chamber[group] = sb.union_all( echo_members[group], backend=backend )
+
     return echo_chamber
 
 ### HIGH-IMPACT USER SCORES ### 
@@ -43,11 +55,11 @@ def get_echo_chambers(audience, chamber, partition):
 def score_1(audience_i, echo_chamber_β, echo_chamber_α):
     '''Returns the score in [-1,1] of the audience of i. 
     A score of 1 means that i leans towards the ideology of β, -1 to the audience of α, 0 to neither.
-    All the inputs are sets of users.
+    All the inputs are sets of users (or ID arrays/bitmaps of the same backend, see set_backends).
     '''
     
-    n_iβ = len( audience_i.intersection( echo_chamber_β ) )
-    n_iα = len( audience_i.intersection( echo_chamber_α ) )
+    n_iβ = sb.intersection_size( audience_i, echo_chamber_β )
+    n_iα = sb.intersection_size( audience_i, echo_chamber_α )
     
     if n_iα + n_iβ == 0:
         return 0
@@ -57,11 +69,11 @@ def score_1(audience_i, echo_chamber_β, echo_chamber_α):
 def score_2(audience_i, echo_chamber_β, echo_chamber_α):
     '''Returns the score in [-1,1] of the audience of i. 
     A score of 1 means that i leans towards the ideology of β, -1 to the audience of α, 0 to neither.
-    All the inputs are sets of users.
+    All the inputs are sets of users (or ID arrays/bitmaps of the same backend, see set_backends).
     '''
     
-    n_iβ = len( audience_i.intersection( echo_chamber_β ) )
-    n_iα = len( audience_i.intersection( echo_chamber_α ) )
+    n_iβ = sb.intersection_size( audience_i, echo_chamber_β )
+    n_iα = sb.intersection_size( audience_i, echo_chamber_α )
     
     n_α = len( echo_chamber_α )
     n_β = len( echo_chamber_β )
@@ -78,32 +90,108 @@ def score_2(audience_i, echo_chamber_β, echo_chamber_α):
 def score_3(audience_i, echo_chamber_β, echo_chamber_α):
     '''Returns the score in [-1,1] of the audience of i. 
     A score of 1 means that i leans towards the ideology of β, -1 to the audience of α, 0 to neither.
-    All the inputs are sets of users.
+    All the inputs are sets of users (or ID arrays/bitmaps of the same backend, see set_backends).
     '''
     
-    n_iβ = len( audience_i.intersection( echo_chamber_β ) )
-    n_iα = len( audience_i.intersection( echo_chamber_α ) )
+    n_iβ = sb.intersection_size( audience_i, echo_chamber_β )
+    n_iα = sb.intersection_size( audience_i, echo_chamber_α )
     
     n_i = len( audience_i )
     
     return (n_iβ - n_iα)/n_i
 
-def ideology_scores( audiences, echo_chamber, users_excluded=[], score_func=score_1 ):
+## Vectorized Score Functions
+# The same scores over arrays: n_iβ, n_iα, n_i are arrays over users, n_β, n_α are the sizes of the echo chambers.
+def score_1_array(n_iβ, n_iα, n_β, n_α, n_i):
+    total = n_iα + n_iβ
+    return np.where( total == 0, 0., (n_iβ - n_iα) / np.where( total == 0, 1, total ) )
+
+def score_2_array(n_iβ, n_iα, n_β, n_α, n_i):
+    if n_α == 0 and n_β == 0:
+        return np.zeros( len(n_i) )
+    if n_α == 0:
+        return n_iβ/n_β
+    if n_β == 0:
+        return - n_iα/n_α
+    return n_iβ/n_β - n_iα/n_α
+
+def score_3_array(n_iβ, n_iα, n_β, n_α, n_i):
+    # NaN for empty audiences
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        return (n_iβ - n_iα)/n_i
+
+VECTORIZED_SCORES = { score_1: score_1_array, score_2: score_2_array, score_3: score_3_array }
+
+def ideology_scores( audiences, echo_chamber, users_excluded=[], score_func=score_1, backend=None, vectorized=True ):
     '''Compute the ideology scores for all the users in audiences:dict{user:audience} according to score_func:function 
     based on the common audience members in echo_chamber:dict{ideology:users}.
+    If backend is given, the audiences and echo chambers are converted to it (see set_backends).
+    If vectorized and score_func is score_1, score_2 or score_3, all the users are scored at once (see batched_ideology_scores).
     '''
     
+    if vectorized and score_func in VECTORIZED_SCORES:
+        users, scores = batched_ideology_scores( audiences, echo_chamber, users_excluded, score_func, backend )
+        return dict( zip( users, scores.tolist() ) )
+
     groups = list( echo_chamber.keys() ) # we assume there are 2 groups
+    echo_chamber = sb.convert_sets( echo_chamber, backend )
     
     scores = dict()
     for (user, audience) in audiences.items():
 
         if user not in users_excluded:
-            scores[user] = score_func( audience, echo_chamber[ groups[1] ], echo_chamber[ groups[0] ] ) 
+            scores[user] = score_func( sb.to_backend( audience, backend ), echo_chamber[ groups[1] ], echo_chamber[ groups[0] ] ) 
             
     return scores
 
-def ideology_scores_dynamics( audiences, echo_chambers, users_excluded=[], score_func=score_1 ):
+def batched_ideology_scores( audiences, echo_chamber, users_excluded=[], score_func=score_1, backend=None ):
+    '''Vectorized ideology_scores. The audiences are stacked in a sparse membership matrix X (users x members), so the
+    n_iα and n_iβ of all the users are two sparse mat-vecs of X with the indicator vectors of the echo chambers.
+    score_func must be one of score_1, score_2, score_3 (score_3 is NaN for empty audiences).
+    Returns (users:list, scores:array).
+    '''
+
+    groups = list( echo_chamber.keys() ) # we assume there are 2 groups
+    if backend is not None:
+        audiences = sb.convert_sets( audiences, backend )
+        echo_chamber = sb.convert_sets( echo_chamber, backend )
+
+    users_excluded = set( users_excluded )
+    audiences = { user: audience for (user, audience) in audiences.items() if user not in users_excluded }
+    users = list( audiences.keys() )
+
+    X, members = audience_membership_matrix( audiences )
+    n_i = np.asarray( X.sum( axis=1 ) ).ravel()
+    n_iβ = X @ echo_chamber_indicator( echo_chamber[ groups[1] ], members, X.shape[1] )
+    n_iα = X @ echo_chamber_indicator( echo_chamber[ groups[0] ], members, X.shape[1] )
+
+    scores = VECTORIZED_SCORES[ score_func ]( n_iβ, n_iα, len( echo_chamber[ groups[1] ] ), len( echo_chamber[ groups[0] ] ), n_i )
+    return users, np.asarray( scores, dtype=float )
+
+def ideology_scores_matrix( audiences, echo_chambers, users=None, users_excluded=[], score_func=score_1, backend=None ):
+    '''Weekly ideology scores (see batched_ideology_scores) where audiences:list and echo_chambers:list or dict (global echo chamber).
+    Returns (scores, users), where scores:array(weeks x users) is aligned on users (the union of the scored users of all the weeks
+    in order of appearance, if None), with NaN for users not scored that week.
+    '''
+
+    weekly_scores = []
+    for (t, audiences_t) in enumerate( audiences ):
+        echo_chamber = echo_chambers[t] if type( echo_chambers ) == list else echo_chambers
+        weekly_scores.append( batched_ideology_scores( audiences_t, echo_chamber, users_excluded, score_func, backend ) )
+
+    if users is None:
+        users = pd.unique( np.array( [ user for (users_t, _) in weekly_scores for user in users_t ], dtype=object ) )
+    user_index = pd.Index( users )
+
+    scores = np.full( ( len(audiences), len(user_index) ), np.nan )
+    for (t, (users_t, scores_t)) in enumerate( weekly_scores ):
+        cols = user_index.get_indexer( np.array( users_t, dtype=object ) )
+        known = cols >= 0
+        scores[ t, cols[known] ] = scores_t[ known ]
+
+    return scores, np.asarray( users )
+
+def ideology_scores_dynamics( audiences, echo_chambers, users_excluded=[], score_func=score_1, backend=None, vectorized=True ):
     '''Compute weekly ideology scores where audiences:list, echo_chambers:list. See ?ideology_scores for details. 
     '''
     
@@ -112,17 +200,42 @@ def ideology_scores_dynamics( audiences, echo_chambers, users_excluded=[], score
     for (t, audiences_t) in enumerate( audiences ):
         
         if type( echo_chambers ) == list: # sequence of weekly echo chambers
-            scores_dynamic.append( ideology_scores(audiences_t, echo_chambers[t], users_excluded, score_func) )
+            scores_dynamic.append( ideology_scores(audiences_t, echo_chambers[t], users_excluded, score_func, backend, vectorized) )
         elif type( echo_chambers ) == dict: # global echo_echamber
-            scores_dynamic.append( ideology_scores(audiences_t, echo_chambers, users_excluded, score_func) )
+            scores_dynamic.append( ideology_scores(audiences_t, echo_chambers, users_excluded, score_func, backend, vectorized) )
         else:
             Exception( "Type of echo_chamber not understood. Can be a `list` of echo_chambers or a dictionary." )
         
     return scores_dynamic
 
+## Membership matrices
+def audience_membership_matrix( audiences ):
+    '''Returns (X, members) where X is the sparse (csr) membership matrix of audiences:dict{user:audience} (see 
+    similarity_metrics.chambers_incidence_matrix) and members:pd.Index its columns (None if the columns are global user IDs).
+    '''
+
+    if len(audiences) > 0 and sb.backend_of( next( iter( audiences.values() ) ) ) != 'python':
+        return sm.chambers_incidence_matrix( audiences ), None
+
+    members = pd.Index( pd.unique( np.array( [ m for A in audiences.values() for m in A ], dtype=object ) ) )
+    return sm.chambers_incidence_matrix( audiences, members=members ), members
+
+def echo_chamber_indicator( echo_chamber, members, num_members ):
+    '''Returns the 0/1 vector over the columns of an audience membership matrix of the users in echo_chamber.
+    '''
+
+    indicator = np.zeros( num_members )
+    if members is None: # columns are global user IDs
+        ids = sb.to_id_array( echo_chamber )
+        indicator[ ids[ ids < num_members ] ] = 1
+    else:
+        indicator[ members.isin( list( echo_chamber ) ) ] = 1
+
+    return indicator
+
 ### ECHO CHAMBER AUGMENTATION ###
-# TODO: include high-impact chambers
-def augment_echo_chambers( scores, audiences_of_scored, echo_chambers, thresh=0.75, users_excluded=[]):
+# see augment_echo_chamber_fixed_point for the iterative augmentation, which can also include the high-impact chambers
+def augment_echo_chambers( scores, audiences_of_scored, echo_chambers, thresh=0.75, users_excluded=[], backend=None):
     '''Augment `echo_chambers`:list[set] from the `scores`:list[dict] >= `thresh` of the high-impact users using the `audiences_of_scored`:list[dict].
     '''
     
@@ -130,34 +243,166 @@ def augment_echo_chambers( scores, audiences_of_scored, echo_chambers, thresh=0.
     
     augmented_echo_chambers = []
     for t in range(len(scores)):
-        augmented_echo_chambers.append( augment_echo_chamber(scores[t], audiences_of_scored[t], echo_chambers[t], thresh=thresh, users_excluded=users_excluded) )
+        augmented_echo_chambers.append( augment_echo_chamber(scores[t], audiences_of_scored[t], echo_chambers[t], thresh=thresh, users_excluded=users_excluded, backend=backend) )
         
     return augmented_echo_chambers
     
-def augment_echo_chamber( scores, audiences_of_scored, echo_chamber, thresh=0.75, users_excluded=[]):
-    '''Augment `echo_chamber`:set
+def augment_echo_chamber( scores, audiences_of_scored, echo_chamber, thresh=0.75, users_excluded=[], backend=None):
+    '''Augment `echo_chamber`:set (or ID array/bitmap, see set_backends). If backend is given, the sets are converted to it.
     '''
     
     groups = list( echo_chamber.keys() )
+    if backend is None:
+        backend = sb.backend_of( echo_chamber[ groups[0] ] )
     augmented_echo_chamber = dict() 
     
     for group in groups:
         # echo_audience[group] = set()
-        augmented_echo_chamber[group] = echo_chamber[group]
+        augmented_echo_chamber[group] = sb.to_backend( echo_chamber[group], backend )
     
+    # members added to every group, united once at the end
+    augmented_members = { group: [ augmented_echo_chamber[group] ] for group in groups }
+
     # augment_echo_chamber = augment_echo_chamber.union( echo_chamber )
     for (user,score) in scores.items():
         if user not in users_excluded:
             if score > thresh:
-                augmented_echo_chamber[ groups[1] ] = augmented_echo_chamber[ groups[1] ].union( audiences_of_scored[user] )
+                augmented_members[ groups[1] ].append( sb.to_backend( audiences_of_scored[user], backend ) )
             elif score < -thresh:
-                augmented_echo_chamber[ groups[0] ] = augmented_echo_chamber[ groups[0] ].union( audiences_of_scored[user] )
+                augmented_members[ groups[0] ].append( sb.to_backend( audiences_of_scored[user], backend ) )
             else:
                 pass
+
+    for group in groups:
+        augmented_echo_chamber[group] = sb.union_all( augmented_members[group], backend=backend )
             
     return augmented_echo_chamber
 
+def augment_echo_chambers_fixed_point( audiences_of_scored, echo_chambers, thresh=0.75, score_func=score_1, users_excluded=[], chambers_of_scored=None, max_iter=20, backend=None ):
+    '''Weekly augment_echo_chamber_fixed_point, where audiences_of_scored:list[dict], echo_chambers:list[dict] (and chambers_of_scored:list[dict]).
+    Returns (augmented_echo_chambers:list, stats:list[dataframe]).
+    '''
+
+    assert len(audiences_of_scored) == len(echo_chambers)
+
+    augmented_echo_chambers, stats = [], []
+    for t in range(len(audiences_of_scored)):
+        chambers_t = None if chambers_of_scored is None else chambers_of_scored[t]
+        augmented, stats_t = augment_echo_chamber_fixed_point( audiences_of_scored[t], echo_chambers[t], thresh, score_func, users_excluded, chambers_t, max_iter, backend )
+
+        augmented_echo_chambers.append( augmented )
+        stats.append( stats_t )
+
+    return augmented_echo_chambers, stats
+
+def augment_echo_chamber_fixed_point( audiences_of_scored, echo_chamber, thresh=0.75, score_func=score_1, users_excluded=[], chambers_of_scored=None, max_iter=20, backend=None ):
+    '''Augments echo_chamber:dict{ideology:users} by repeating score -> augment -> rescore until no member is added (or max_iter rounds).
+    In every round, the users with score > thresh (< -thresh) add their audience (and their chamber, if chambers_of_scored:dict 
+    is given) to the second (first) group, as in augment_echo_chamber. score_func must be one of score_1, score_2, score_3.
+
+    The counts n_iα, n_iβ are updated incrementally from the members newly added in the round (the delta sets), so only the users
+    whose audience overlaps them are rescored (all of them for score_2, which depends on the sizes of the echo chambers).
+    Users are added at most once to every group, so membership grows monotonically. max_iter must be at least 1.
+
+    Returns (augmented_echo_chamber:dict, stats:dataframe) with the growth statistics of every round.
+    '''
+
+    if max_iter < 1:
+        raise ValueError( "max_iter must be at least 1, got {}".format( max_iter ) )
+
+    groups = list( echo_chamber.keys() ) # we assume there are 2 groups
+    if backend is None:
+        backend = sb.backend_of( echo_chamber[ groups[0] ] )
+    echo_chamber = sb.convert_sets( echo_chamber, backend )
+    vectorized_score = VECTORIZED_SCORES[ score_func ]
+
+    users_excluded = set( users_excluded )
+    users = [ user for user in audiences_of_scored.keys() if user not in users_excluded ]
+    audiences = { user: sb.to_backend( audiences_of_scored[user], backend ) for user in users }
+
+    # members added by every user: its audience (and chamber)
+    X, members = audience_membership_matrix( audiences )
+    X_added = X
+    if chambers_of_scored is not None:
+        chambers = { user: sb.to_backend( chambers_of_scored.get( user, sb.empty_set( backend ) ), backend ) for user in users }
+        (X, X_chambers), members = _shared_membership_matrices( [ audiences, chambers ] )
+        X_added = X + X_chambers
+    X_added = X_added.tocsr()
+    X_csc = X.tocsc()
+    num_members = X.shape[1]
+
+    in_echo = { group: echo_chamber_indicator( echo_chamber[group], members, num_members ).astype( bool ) for group in groups }
+    sizes = { group: len( echo_chamber[group] ) for group in groups }
+    added = { group: np.zeros( len(users), dtype=bool ) for group in groups }
+
+    n_i = np.asarray( X.sum( axis=1 ) ).ravel()
+    n_ig = { group: X @ in_echo[group].astype( float ) for group in groups }
+    scores = vectorized_score( n_ig[ groups[1] ], n_ig[ groups[0] ], sizes[ groups[1] ], sizes[ groups[0] ], n_i )
+
+    stats = []
+    rescored = len(users)
+    for iteration in range( max_iter ):
+
+        new_users = { groups[1]: ( scores > thresh ) & ~added[ groups[1] ], groups[0]: ( scores < -thresh ) & ~added[ groups[0] ] }
+
+        touched = np.zeros( len(users), dtype=bool )
+        changed = False
+        round_stats = { 'iteration': iteration, 'users_rescored': rescored }
+        for group in groups:
+            added[group] |= new_users[group]
+
+            # delta set: members of the new users not yet in the echo chamber
+            candidates = np.asarray( X_added[ new_users[group] ].sum( axis=0 ) ).ravel() > 0
+            delta = np.flatnonzero( candidates & ~in_echo[group] )
+            in_echo[group][ delta ] = True
+            sizes[group] += len(delta)
+            changed |= len(delta) > 0
+
+            if len(delta) > 0:
+                increments = np.asarray( X_csc[ :, delta ].sum( axis=1 ) ).ravel()
+                n_ig[group] += increments
+                touched |= increments > 0
+
+            round_stats[ 'new_scored_users_{}'.format(group) ] = int( new_users[group].sum() )
+            round_stats[ 'new_members_{}'.format(group) ] = len(delta)
+            round_stats[ 'size_{}'.format(group) ] = sizes[group]
+
+        stats.append( round_stats )
+        if not changed: # no new members, fixed point
+            break
+
+        # rescore the users whose counts changed
+        if score_func is score_2:
+            touched[:] = True
+        scores[ touched ] = vectorized_score( n_ig[ groups[1] ][ touched ], n_ig[ groups[0] ][ touched ], sizes[ groups[1] ], sizes[ groups[0] ], n_i[ touched ] )
+        rescored = int( touched.sum() )
+
+    augmented_echo_chamber = dict()
+    for group in groups:
+        new_members = np.flatnonzero( in_echo[group] )
+        if members is None:
+            new_members = new_members.astype( np.int32 )
+        else:
+            new_members = set( members[ new_members ] )
+        augmented_echo_chamber[group] = sb.union_all( [ echo_chamber[group], sb.to_backend( new_members, backend ) ], backend=backend )
+
+    stats = pd.DataFrame( stats )
+    stats['converged'] = stats[ [ 'new_members_{}'.format(group) for group in groups ] ].iloc[-1].sum() == 0
+    return augmented_echo_chamber, stats
+
 ## Helpers
+def _shared_membership_matrices( set_dicts ):
+    # membership matrices of every dict{user:set} (same users) over the same columns
+    if len( set_dicts[0] ) > 0 and sb.backend_of( next( iter( set_dicts[0].values() ) ) ) != 'python':
+        matrices = [ sm.chambers_incidence_matrix( sets ) for sets in set_dicts ]
+        num_members = max( X.shape[1] for X in matrices )
+        for X in matrices:
+            X.resize( ( X.shape[0], num_members ) )
+        return matrices, None
+
+    members = pd.Index( pd.unique( np.array( [ m for sets in set_dicts for S in sets.values() for m in S ], dtype=object ) ) )
+    return [ sm.chambers_incidence_matrix( sets, members=members ) for sets in set_dicts ], members
+
 def flatten_array_of_dicts(x):
     '''Concatenates all the dicts of array:array[dict].'''
     
@@ -0,0 +1,81 @@
+from collections import Counter, deque
+# local
+import chambers_and_audiences as ca
+
+###################### STREAMING HIGH-IMPACT / PERSISTENCE TRACKER ######################
+class ImpactTracker:
+    '''Streaming version of chambers_and_audiences.temporal_leading_impacts.
+
+    Weeks are ingested one at a time with `add_week`, which only computes the leading impact vector of the new week and updates
+    the persistence counts, so adding week t+1 costs one week of work. If `window` is given, only the last `window` weeks are
+    kept and the persistence counts are those of a sliding window.
+
+    Inputs:
+        - num_highimpact_users: number of high-impact users per week (N in the paper), or a percentage in (0,1).
+        - window: number of weeks in the sliding window (None keeps every week).
+    '''
+
+    def __init__( self, num_highimpact_users, window=None, target='target', weight='weight' ):
+
+        self.num_highimpact_users = num_highimpact_users
+        self.window = window
+        self.target = target
+        self.weight = weight
+
+        self.leading_impacts = deque() # leading impact vector of every week in the window
+        self.leading_users = deque()   # set of high-impact users of every week in the window
+        self.persistence = Counter()   # number of weeks in the window each user was a high-impact user
+        self.num_weeks_seen = 0
+
+    def add_week( self, edgelist ):
+        '''Ingests the edgelist of the next week and returns the set of its high-impact users.
+        '''
+
+        leading_impact = ca.get_leading_impact_vector( edgelist, self.num_highimpact_users, target=self.target, weight=self.weight )
+        users = set( leading_impact.index )
+
+        self.leading_impacts.append( leading_impact )
+        self.leading_users.append( users )
+        self.persistence.update( users )
+        self.num_weeks_seen += 1
+
+        if (self.window is not None) and (len(self.leading_users) > self.window):
+            self.leading_impacts.popleft()
+            self.persistence.subtract( self.leading_users.popleft() )
+            # drop users that are no longer in the window
+            self.persistence += Counter()
+
+        return users
+
+    def add_weeks( self, edgelists ):
+        for edgelist in edgelists:
+            self.add_week( edgelist )
+        return self
+
+    def users_persistence( self, num_persistent_users=None ):
+        '''Returns the [(user, persistence)] of the `num_persistent_users` most persistent users in the window (all if None).
+        '''
+        return self.persistence.most_common( num_persistent_users )
+
+    def leading_persistent_users( self, num_persistent_users ):
+        '''Returns the current leading persistent users (M in the paper).
+        '''
+        return ca.get_users_from_users_persistence_dict( self.users_persistence( num_persistent_users ) )
+
+    def persistent_impacts( self, num_persistent_users ):
+        '''Returns (persistent_impact_vec, persistent_users_vec, users_persistence) over the weeks in the window, as in
+        chambers_and_audiences.temporal_leading_impacts.
+        '''
+
+        users_persistence = self.users_persistence( num_persistent_users )
+        persistent_users = ca.get_users_from_users_persistence_dict( users_persistence )
+
+        persistent_impact_vec = []
+        persistent_users_vec  = []
+        for leading_impact in self.leading_impacts:
+            persistent_impacts = leading_impact[ leading_impact.index.isin( persistent_users ) ]
+
+            persistent_impact_vec.append( persistent_impacts )
+            persistent_users_vec.append( set( persistent_impacts.index ) )
+
+        return persistent_impact_vec, persistent_users_vec, users_persistence
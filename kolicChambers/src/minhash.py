@@ -0,0 +1,122 @@
+import itertools
+import numpy as np
+import pandas as pd
+# local
+import set_backends as sb
+
+###################### MINHASH / LSH APPROXIMATE CHAMBER OVERLAPS ######################
+# Mersenne prime for the universal hash family h(x) = (a*x + b) mod P, with x < 2^32 so that a*x + b fits in uint64
+MERSENNE_PRIME = np.uint64( (1 << 61) - 1 )
+MAX_HASH = np.uint64( (1 << 32) - 1 )
+
+def num_perm_from_error( max_error ):
+    '''Returns the number of permutations needed for a MinHash Jaccard estimate with standard error `max_error`.
+    The estimate is a mean of num_perm Bernoulli trials, so its standard error is at most 1/(2*sqrt(num_perm)).
+    '''
+    return int( np.ceil( 1/(2*max_error)**2 ) )
+
+def minhash_signatures( chambers, num_perm=128, seed=0, chunk_size=8192 ):
+    '''Returns the (len(chambers) x num_perm) array with the MinHash signatures of chambers:dict{user:set}.
+    Use the same `seed` to compare signatures of different weeks. Empty chambers get a signature of MAX_HASH.
+    Memory is linear in the number of chambers: members are hashed in chunks of `chunk_size`.
+    '''
+
+    rng = np.random.default_rng( seed )
+    a = rng.integers( 1, MAX_HASH, size=num_perm, dtype=np.uint64 )
+    b = rng.integers( 0, MAX_HASH, size=num_perm, dtype=np.uint64 )
+
+    signatures = np.full( [ len(chambers), num_perm ], MAX_HASH, dtype=np.uint64 )
+    for (i, C) in enumerate( chambers.values() ):
+
+        hashes = hash_members( C )
+        for k in range( 0, len(hashes), chunk_size ):
+            x = hashes[ k:k+chunk_size ]
+            permuted = ( ( a[:,None]*x[None,:] + b[:,None] ) % MERSENNE_PRIME ) & MAX_HASH
+            signatures[i] = np.minimum( signatures[i], permuted.min( axis=1 ) )
+
+    return signatures
+
+def minhash_jaccard( signatures, i, j ):
+    '''Returns the estimated Jaccard similarity between the chambers in rows i and j of `signatures`.
+    '''
+    return np.mean( signatures[i] == signatures[j] )
+
+def lsh_parameters( num_perm, threshold ):
+    '''Returns the (num_bands, rows_per_band) with num_bands*rows_per_band <= num_perm whose LSH threshold (1/b)^(1/r)
+    is the closest to `threshold`.
+    '''
+    candidates = [ (b, num_perm//b) for b in range(1, num_perm+1) ]
+    return min( candidates, key=lambda br: abs( (1/br[0])**(1/br[1]) - threshold ) )
+
+def lsh_candidate_pairs( signatures, threshold, num_bands=None ):
+    '''Returns the set of pairs (i,j), i<j, whose signatures share at least one LSH band, i.e. the candidate pairs with
+    Jaccard similarity above `threshold` (with high probability).
+    '''
+
+    num_perm = signatures.shape[1]
+    if num_bands is None:
+        num_bands, rows_per_band = lsh_parameters( num_perm, threshold )
+    else:
+        rows_per_band = num_perm//num_bands
+
+    # empty chambers have no overlap with anyone
+    nonempty = np.flatnonzero( ( signatures != MAX_HASH ).any( axis=1 ) )
+
+    candidates = set()
+    for band in range( num_bands ):
+
+        band_signatures = signatures[ :, band*rows_per_band:(band+1)*rows_per_band ]
+        buckets = dict()
+        for i in nonempty:
+            buckets.setdefault( band_signatures[i].tobytes(), [] ).append( i )
+
+        for bucket in buckets.values():
+            candidates.update( itertools.combinations( bucket, 2 ) )
+
+    return candidates
+
+def minhash_similarity_matrix( chambers, num_perm=128, max_error=None, lsh_threshold=None, seed=0 ):
+    '''Returns the approximate Jaccard similarity matrix of chambers:dict{user:set} based on MinHash signatures.
+
+    If max_error is given, the number of permutations is chosen so that the standard error of each entry is below it.
+    If lsh_threshold is given, only the LSH candidate pairs with estimated similarity >= lsh_threshold are filled in.
+    As in similarity_metrics.jaccard_similarity, pairs without overlap are NaN and the diagonal is 0.
+    '''
+
+    if max_error is not None:
+        num_perm = num_perm_from_error( max_error )
+
+    signatures = minhash_signatures( chambers, num_perm=num_perm, seed=seed )
+    nonempty = ( signatures != MAX_HASH ).any( axis=1 )
+
+    similarities = np.full( [ len(chambers), len(chambers) ], np.nan )
+
+    if lsh_threshold is None:
+        # one row at a time to keep memory linear in the number of chambers
+        for i in range( len(chambers) ):
+            similarities[i] = ( signatures == signatures[i] ).mean( axis=1 )
+        similarities[ ~nonempty, : ] = np.nan
+        similarities[ :, ~nonempty ] = np.nan
+    else:
+        for (i,j) in lsh_candidate_pairs( signatures, lsh_threshold ):
+            similarity_ij = minhash_jaccard( signatures, i, j )
+            if similarity_ij >= lsh_threshold:
+                similarities[i,j] = similarity_ij
+                similarities[j,i] = similarity_ij
+
+    similarities[ similarities == 0 ] = np.nan
+    np.fill_diagonal( similarities, 0 )
+
+    return pd.DataFrame( similarities, index=chambers.keys(), columns=chambers.keys() )
+
+## Helpers
+def hash_members( members ):
+    '''Returns the deterministic 32-bit hashes (as uint64) of the users in members:set (or ID array/bitmap, see set_backends).
+    '''
+    if len( members ) == 0:
+        return np.zeros( 0, dtype=np.uint64 )
+
+    if sb.backend_of( members ) != 'python':
+        return pd.util.hash_array( sb.to_id_array( members ).astype( np.int64 ) ) & MAX_HASH
+
+    return pd.util.hash_array( np.array( list( members ), dtype=object ) ) & MAX_HASH
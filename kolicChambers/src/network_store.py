@@ -0,0 +1,123 @@
+import os
+import numpy as np
+import pandas as pd
+# local
+from retweet_graph import RetweetGraph
+from user_dictionary import UserDictionary
+
+###################### COLUMNAR STORE OF WEEKLY RETWEET NETWORKS ######################
+# Layout of a store directory:
+#   users.npy                                   global user dictionary (ID -> user, see user_dictionary.UserDictionary)
+#   weeks.txt                                   names of the weeks in temporal order, one per line
+#   <week>/source.npy, target.npy, weight.npy   int32 user IDs and weights of the edges of every week
+# Every array is a plain .npy file, so weeks are opened memory-mapped and their pages are shared across processes.
+
+USERS_FILE = 'users.npy'
+WEEKS_FILE = 'weeks.txt'
+
+def convert_weekly_networks( csv_path, store_path, extension='.csv', source='source', target='target', weight='weight', **read_csv_kw ):
+    '''Converts every `extension` file in csv_path (sorted by name) into the columnar store at store_path.
+    If the store already exists, the weeks are appended and the new users are appended to its user dictionary.
+    Returns the names of the converted weeks.
+    '''
+
+    user_ids, weeks = _read_store_index( store_path )
+
+    converted_weeks = []
+    for file in sorted( os.listdir( csv_path ) ):
+        if not file.endswith( extension ):
+            continue
+
+        edgelist = pd.read_csv( os.path.join( csv_path, file ), **read_csv_kw )
+        week = file[ :-len(extension) ]
+
+        save_week( store_path, week, edgelist, user_ids, source=source, target=target, weight=weight )
+        if week not in weeks:
+            weeks.append( week )
+        converted_weeks.append( week )
+
+    _write_store_index( store_path, user_ids, weeks )
+    return converted_weeks
+
+def save_week( store_path, week, edgelist, user_ids, source='source', target='target', weight='weight' ):
+    '''Saves edgelist:dataframe as `week` in the store, encoding its users with user_ids:UserDictionary (new users are appended).
+    '''
+
+    codes = user_ids.add( pd.concat( [ edgelist[ source ], edgelist[ target ] ], ignore_index=True ) )
+
+    if weight in edgelist.columns:
+        weights = edgelist[ weight ].to_numpy()
+    else:
+        weights = np.ones( len(edgelist), dtype=np.int32 )
+
+    week_path = os.path.join( store_path, week )
+    os.makedirs( week_path, exist_ok=True )
+    np.save( os.path.join( week_path, 'source.npy' ), codes[ :len(edgelist) ] )
+    np.save( os.path.join( week_path, 'target.npy' ), codes[ len(edgelist): ] )
+    np.save( os.path.join( week_path, 'weight.npy' ), weights )
+
+def load_weekly_networks( store_path, weeks=None, as_dataframe=False, mmap=True, as_ids=False, source='source', target='target', weight='weight' ):
+    '''Returns the weekly networks of the store (all of them, in temporal order, if weeks is None).
+
+    By default every week is a RetweetGraph over the users of the week only (their global IDs are mapped to week codes, so the
+    CSR arrays and adjacency matrices are sized to the week, not to the corpus). If as_ids, the graphs return sets of users as
+    arrays of global user IDs (see load_user_dictionary).
+    If as_dataframe, every week is an edgelist:dataframe with categorical source/target columns over the users of the week.
+    The arrays are read memory-mapped if mmap; the weights stay memory-mapped, the endpoints are remapped to the week's codes.
+    '''
+
+    user_ids, all_weeks = _read_store_index( store_path )
+    if weeks is None:
+        weeks = all_weeks
+
+    networks = []
+    for week in weeks:
+
+        sources, targets, weights = load_week_arrays( store_path, week, mmap=mmap )
+
+        # global IDs used in the week (sorted) -> week codes
+        ids, codes = np.unique( np.concatenate( [ sources, targets ] ), return_inverse=True )
+        sources, targets = codes[ :len(sources) ].astype( np.int32 ), codes[ len(sources): ].astype( np.int32 )
+        week_users = user_ids.labels.take( ids )
+
+        if as_dataframe:
+            networks.append( pd.DataFrame( {
+                source: pd.Categorical.from_codes( sources, categories=week_users ),
+                target: pd.Categorical.from_codes( targets, categories=week_users ),
+                weight: weights,
+            } ) )
+        else:
+            networks.append( RetweetGraph( week_users, sources, targets, weights, ids=ids.astype( np.int32 ) if as_ids else None ) )
+
+    return networks
+
+def load_user_dictionary( store_path ):
+    '''Returns the global UserDictionary of the store.
+    '''
+    return UserDictionary.load( os.path.join( store_path, USERS_FILE ) )
+
+def load_week_arrays( store_path, week, mmap=True ):
+    '''Returns the (source, target, weight) arrays of `week`, memory-mapped if mmap.
+    '''
+    mmap_mode = 'r' if mmap else None
+    week_path = os.path.join( store_path, week )
+
+    return tuple( np.load( os.path.join( week_path, name + '.npy' ), mmap_mode=mmap_mode ) for name in ['source', 'target', 'weight'] )
+
+## Helpers
+def _read_store_index( store_path ):
+    user_ids = load_user_dictionary( store_path )
+    if not os.path.exists( os.path.join( store_path, WEEKS_FILE ) ):
+        return user_ids, []
+
+    with open( os.path.join( store_path, WEEKS_FILE ) ) as f:
+        weeks = [ line.strip() for line in f if line.strip() ]
+
+    return user_ids, weeks
+
+def _write_store_index( store_path, user_ids, weeks ):
+    os.makedirs( store_path, exist_ok=True )
+    user_ids.save( os.path.join( store_path, USERS_FILE ) )
+
+    with open( os.path.join( store_path, WEEKS_FILE ), 'w' ) as f:
+        f.write( '\n'.join( weeks ) + '\n' )
@@ -1,5 +1,9 @@
+import os
 import numpy as np 
+import pandas as pd
 from operator import itemgetter
+# local
+import weekly_pool as wp
 
 """General notation: p_in_a : frac of edges inside community alpha. p_in: aggregate frac of in-edges.
 p_out: frac of edges goin from one ocmmunity to the other"""
@@ -42,10 +46,17 @@ def polarisation6( n_11, n_22, n_12, n_21 ):
     return (in_strength - out_strength)/(in_strength + out_strength)
 
 
+POLARISATION_FUNCS = [ polarisation1, polarisation2, polarisation3, polarisation4, polarisation5, polarisation6 ]
+
 ### MAIN FUNCTIONS ### 
-def community_polarisation( edgelist, users_C1, users_C2, polarisation_func=polarisation6, source='source', target='target', weight='weight' ):
+def community_polarisation( edgelist, users_C1, users_C2, polarisation_func=polarisation6, source='source', target='target', weight='weight', user_ids=None ):
     """ Returns the polarization value between communities C1 and C2 for a given `polarization_func`.
+    If user_ids:UserDictionary is given, the users of the edgelist and the communities are matched by their global IDs.
     """
+
+    if user_ids is not None:
+        edgelist = encode_edgelist( edgelist, user_ids, source=source, target=target )
+        users_C1, users_C2 = encode_community( users_C1, user_ids ), encode_community( users_C2, user_ids )
     
     mask_sources_in_C1 = edgelist[ source ].isin( users_C1 )
     mask_sources_in_C2 = edgelist[ source ].isin( users_C2 )
@@ -72,45 +83,96 @@ def community_polarisation( edgelist, users_C1, users_C2, polarisation_func=pola
     
     return polarization
 
-def network_polarization( edgelist, partition, polarisation_func=polarisation6, return_polarization_array=False, source='source', target='target', weight='weight' ):
+def network_polarization( edgelist, partition, polarisation_func=polarisation6, return_polarization_array=False, source='source', target='target', weight='weight', user_ids=None ):
     ''' Given an edgelist (network) and its partition, compute the mean polarization between all pairs of communities.
+    If user_ids:UserDictionary is given, the edgelist and the partition are encoded once with the global user IDs.
+
+    The edgelist is scanned once to build the community contingency matrix (see community_contingency_matrix), from which
+    the polarization of every pair of communities is derived.
     '''
 
-    names_of_communities = np.unique(list(partition.values()))
-    
-    polarization_of_community_pairs = []
-    community_pairs = []
-    for (i,comm_i) in enumerate(names_of_communities):
-        for (j,comm_j) in enumerate(names_of_communities):
-            if i < j:                
-                
-                Ci = get_users_in_community(partition, comm_i)
-                Cj = get_users_in_community(partition, comm_j)
-                
-                Cij = comm_i+'_'+comm_j
-                polarization_ij = community_polarisation( edgelist, Ci, Cj, source=source, target=target, weight=weight, polarisation_func=polarisation_func )
-                
-                community_pairs.append( Cij )
-                polarization_of_community_pairs.append( polarization_ij )
+    if user_ids is not None:
+        edgelist = encode_edgelist( edgelist, user_ids, source=source, target=target )
+        partition = encode_partition( partition, user_ids )
+
+    N, names_of_communities = community_contingency_matrix( edgelist, partition, source=source, target=target, weight=weight )
+    community_pairs, polarization_of_community_pairs = pairwise_polarisation( N, names_of_communities, polarisation_func=polarisation_func )
                     
     if return_polarization_array:
         return np.mean(polarization_of_community_pairs), dict( zip(community_pairs, polarization_of_community_pairs) )
     else: 
         return np.mean(polarization_of_community_pairs)
+
+def network_polarizations( edgelist, partition, polarisation_funcs=None, source='source', target='target', weight='weight', user_ids=None ):
+    ''' Returns {polarisation_func name: (mean polarization, {community pair: polarization})} for every function in 
+    polarisation_funcs (all of POLARISATION_FUNCS by default), from a single scan of the edgelist.
+    '''
+
+    if polarisation_funcs is None:
+        polarisation_funcs = POLARISATION_FUNCS
+
+    if user_ids is not None:
+        edgelist = encode_edgelist( edgelist, user_ids, source=source, target=target )
+        partition = encode_partition( partition, user_ids )
+
+    N, names_of_communities = community_contingency_matrix( edgelist, partition, source=source, target=target, weight=weight )
+
+    polarizations = dict()
+    for polarisation_func in polarisation_funcs:
+        community_pairs, polarization_of_community_pairs = pairwise_polarisation( N, names_of_communities, polarisation_func=polarisation_func )
+        polarizations[ polarisation_func.__name__ ] = ( np.mean(polarization_of_community_pairs), dict( zip(community_pairs, polarization_of_community_pairs) ) )
+
+    return polarizations
+
+def community_contingency_matrix( edgelist, partition, source='source', target='target', weight='weight', names_of_communities=None ):
+    ''' Returns the (K x K) matrix N where N[a,b] is the total weight of the edges from community a to community b, and the
+    (sorted) names of the K communities in partition:dict{user:community}. Edges with an endpoint out of the partition are ignored.
+    If names_of_communities is given, N follows its order and has a row and column for each of them, even if empty.
+    '''
+
+    if names_of_communities is None:
+        names_of_communities, community_codes = np.unique( list( partition.values() ), return_inverse=True )
+    else:
+        community_codes = pd.Index( names_of_communities ).get_indexer( list( partition.values() ) )
+    K = len( names_of_communities )
+
+    source_codes, target_codes = get_community_codes( edgelist, partition, community_codes, source=source, target=target )
+    in_partition = ( source_codes >= 0 ) & ( target_codes >= 0 )
+
+    # missing weights count as 0, as in pandas' sum
+    weights = np.nan_to_num( edgelist[ weight ].to_numpy( dtype=float )[ in_partition ] )
+
+    N = np.bincount( 
+            source_codes[ in_partition ]*K + target_codes[ in_partition ], 
+            weights=weights, 
+            minlength=K*K 
+            ).reshape( K, K )
+
+    return N, names_of_communities
+
+def pairwise_polarisation( N, names_of_communities, polarisation_func=polarisation6 ):
+    ''' Returns the community pairs 'Ci_Cj' (i < j) and their polarization given the community contingency matrix N.
+    The polarisation functions are evaluated on arrays, i.e. on all the pairs at once.
+    '''
+
+    I, J = np.triu_indices( len( names_of_communities ), k=1 )
+    
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        polarization_of_community_pairs = polarisation_func( N[I,I], N[J,J], N[I,J], N[J,I] )
+
+    community_pairs = [ str(comm_i)+'_'+str(comm_j) for (comm_i, comm_j) in zip( names_of_communities[I], names_of_communities[J] ) ]
+    return community_pairs, list( polarization_of_community_pairs )
     
 
-# not optimal, this should go through partition once rather than once per community
 def separate_partition_dict(partition):
     """
     Transform partition into a dict with the users in each community
     """
 
-    community_names = set( partition.values() )
-    
+    # single pass through the partition
     users_per_comm = dict()
-    for comm_name in community_names:
-        
-        users_per_comm[comm_name] = [users for (users, comm) in partition.items() if comm == comm_name] 
+    for (user, comm) in partition.items():
+        users_per_comm.setdefault( comm, [] ).append( user )
         
     return users_per_comm
 
@@ -118,16 +180,24 @@ def separate_partition_dict(partition):
 
 ### RANDOM ENSEMBLES FUNCTIONS 
 def shuffle_dict(dictionary, random_state=None):
-    '''Shuffle values in a dictionary
+    '''Shuffle values in a dictionary. random_state can be a seed or a np.random.Generator.
     '''
-    shuffled_values = list(dictionary.values()) 
-    np.random.shuffle( shuffled_values ) 
+    rng = np.random.default_rng( random_state )
+    shuffled_values = rng.permutation( np.array( list(dictionary.values()), dtype=object ) )
     return dict( zip( list(dictionary.keys()), shuffled_values ) )
 
-def community_polarisation_shuffled( edgelist, users_C1, users_C2, polarisation_func=polarisation6, source='source', target='target', weight='weight' ):
+def community_polarisation_shuffled( edgelist, users_C1, users_C2, polarisation_func=polarisation6, source='source', target='target', weight='weight', random_state=None ):
+    '''Returns the polarization between C1 and C2 after shuffling the community labels of the users in C1 and C2 (community 
+    sizes are kept). A single realization of the null model of community_polarisation_shuffled_ensemble.
     '''
-    '''
-    pass
+
+    partition = { **{ user: 'C1' for user in users_C1 }, **{ user: 'C2' for user in users_C2 } }
+    shuffled_partition = shuffle_dict( partition, random_state=random_state )
+
+    # both communities are kept (2 x 2), even if one of them is empty
+    N, _ = community_contingency_matrix( edgelist, shuffled_partition, source=source, target=target, weight=weight, names_of_communities=['C1', 'C2'] )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        return polarisation_func( N[0,0], N[1,1], N[0,1], N[1,0] )
 
 def community_polarisation_shuffled_ensemble(
     edgelists, 
@@ -138,19 +208,161 @@ def community_polarisation_shuffled_ensemble(
     polarisation_func=polarisation6,
     source='source',
     target='target',
-    weight='weight'
+    weight='weight',
+    random_state=None,
+    n_jobs=None,
+    executor=None
 ):
+    """ Returns, for every edgelist in edgelists, the array with the `ensemble_size` polarizations between the communities 
+    C1_name and C2_name of partition when the labels of their users are shuffled (see polarisation_null_ensemble).
     """
-    """
+
+    pair_partition = { user: comm for (user, comm) in partition.items() if comm in (C1_name, C2_name) }
+
+    missing = [ comm for comm in (C1_name, C2_name) if comm not in set( pair_partition.values() ) ]
+    if len(missing) > 0:
+        raise ValueError( 'communities {} are not in the partition'.format( missing ) )
+
+    # key of the pair in the null model (communities are sorted there, the polarisation functions are symmetric)
+    first, second = sorted( [C1_name, C2_name] )
+    pair = str(first)+'_'+str(second)
+
+    rng = np.random.default_rng( random_state )
     
     polarization_ensemble = []
-    for i in range(ensemble_size):
+    for edgelist in edgelists:
         
-        pass
+        null_model = polarisation_null_ensemble( edgelist, pair_partition, ensemble_size, polarisation_func=polarisation_func, 
+            source=source, target=target, weight=weight, random_state=rng, n_jobs=n_jobs, executor=executor )
+        polarization_ensemble.append( null_model[pair]['null'] )
     
-    pass
+    return polarization_ensemble
+
+def polarisation_null_ensemble( edgelist, partition, ensemble_size=1000, polarisation_func=polarisation6, source='source', target='target', weight='weight', random_state=None, n_jobs=None, executor=None, chunk_size=100, max_cells=2**24 ):
+    """ Null model of the polarization between every pair of communities: the community labels of partition:dict{user:community}
+    are shuffled `ensemble_size` times (community sizes are kept).
+
+    The endpoints of the edgelist are coded once. Each chunk of `chunk_size` permutations is drawn as an int matrix 
+    (permutations x users) and the contingency matrices of all of them are accumulated with np.bincount, in blocks of at
+    most `max_cells` (permutations x edges) so that memory stays bounded on large weeks.
+    If n_jobs or executor are given, chunks of permutations run over a process pool (one task per worker, so the coded edges
+    are sent once to each worker). The result does not depend on n_jobs nor on max_cells.
+
+    Returns {community pair: {'observed', 'null' (array of ensemble_size), 'z_score', 'p_value'}}, where p_value is the
+    fraction of shuffled partitions at least as polarized as the observed one (with the +1 correction).
+    """
+
+    names_of_communities, community_codes = np.unique( list( partition.values() ), return_inverse=True )
+    K = len( names_of_communities )
+
+    # observed polarization
+    N, _ = community_contingency_matrix( edgelist, partition, source=source, target=target, weight=weight )
+    community_pairs, observed = pairwise_polarisation( N, names_of_communities, polarisation_func=polarisation_func )
+
+    # edges with both endpoints in the partition, coded by the position of their users in partition
+    source_positions, target_positions = get_partition_positions( edgelist, partition, source=source, target=target )
+    in_partition = ( source_positions >= 0 ) & ( target_positions >= 0 )
+    source_positions, target_positions = source_positions[ in_partition ], target_positions[ in_partition ]
+    weights = np.nan_to_num( edgelist[ weight ].to_numpy( dtype=float )[ in_partition ] )
+
+    # one independent random stream per chunk, so that results are reproducible for any n_jobs
+    chunk_sizes = [ min( chunk_size, ensemble_size - k ) for k in range( 0, ensemble_size, chunk_size ) ]
+    seeds = np.random.SeedSequence( np.random.default_rng( random_state ).integers( 2**63 ) ).spawn( len( chunk_sizes ) )
+    chunks = list( zip( chunk_sizes, seeds ) )
+
+    if (n_jobs is not None) or (executor is not None):
+        # the chunks are split in one contiguous group per worker, so the coded edges are pickled once per worker
+        num_groups = min( len(chunks), n_jobs or os.cpu_count() or 1 )
+        groups = [ chunks[ k*len(chunks)//num_groups: (k+1)*len(chunks)//num_groups ] for k in range( num_groups ) ]
+        tasks = [ ( source_positions, target_positions, weights, community_codes, K, group, max_cells ) for group in groups ]
+        contingency_chunks = wp.map_items( _shuffled_contingency_task, tasks, n_jobs=n_jobs, executor=executor )
+    else:
+        contingency_chunks = [ _shuffled_contingency_matrices( source_positions, target_positions, weights, community_codes, K, size, seed, max_cells ) 
+                                for (size, seed) in chunks ]
+
+    N_null = np.concatenate( contingency_chunks ) if contingency_chunks else np.zeros( (0, K, K) )
+
+    I, J = np.triu_indices( K, k=1 )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        null = polarisation_func( N_null[:,I,I], N_null[:,J,J], N_null[:,I,J], N_null[:,J,I] ) # (ensemble_size x pairs)
+
+        null_mean = np.nanmean( null, axis=0 )
+        null_std = np.nanstd( null, axis=0 )
+        z_scores = ( np.array( observed ) - null_mean )/null_std
+        p_values = ( 1 + np.sum( null >= np.array( observed ), axis=0 ) )/( 1 + ensemble_size )
+
+    null_model = dict()
+    for (k, pair) in enumerate( community_pairs ):
+        null_model[pair] = { 'observed': observed[k], 'null': null[:,k], 'z_score': z_scores[k], 'p_value': p_values[k] }
+
+    return null_model
 
 ## HELPERS 
+def get_community_codes( edgelist, partition, community_codes, source='source', target='target' ):
+    '''Returns the community code (position in community_codes, aligned with partition) of the source and target of every edge, 
+    with -1 for the users out of the partition.
+    '''
+    community_codes = np.append( community_codes, -1 ) # users not found (position -1) map to -1
+
+    source_positions, target_positions = get_partition_positions( edgelist, partition, source=source, target=target )
+    return community_codes[ source_positions ], community_codes[ target_positions ]
+
+def get_partition_positions( edgelist, partition, source='source', target='target' ):
+    '''Returns the position in partition of the source and target of every edge, with -1 for the users out of the partition.
+    '''
+    users = pd.Index( list( partition.keys() ) )
+    return users.get_indexer( edgelist[ source ] ), users.get_indexer( edgelist[ target ] )
+
+def _shuffled_contingency_matrices( source_positions, target_positions, weights, community_codes, K, num_permutations, seed, max_cells=2**24 ):
+    '''Returns the (num_permutations x K x K) contingency matrices of num_permutations shufflings of community_codes.
+    Permutations are processed in blocks of at most max_cells (permutations x max(edges, users)) entries.
+    '''
+    rng = np.random.default_rng( seed )
+    block_size = max( 1, max_cells//max( len(source_positions), len(community_codes), 1 ) )
+
+    N = np.zeros( ( num_permutations, K, K ) )
+    for start in range( 0, num_permutations, block_size ):
+        size = min( block_size, num_permutations - start )
+
+        # rows are shuffled in order, so the blocks draw the same permutations as a single matrix would
+        labels = rng.permuted( np.tile( community_codes, ( size, 1 ) ), axis=1 ) # (permutations x users)
+
+        offsets = ( np.arange( size )*K*K )[:, None]
+        cells = offsets + labels[ :, source_positions ]*K + labels[ :, target_positions ]
+
+        N[ start:start+size ] = np.bincount( cells.ravel(), weights=np.tile( weights, size ), minlength=size*K*K ).reshape( size, K, K )
+
+    return N
+
+def _shuffled_contingency_task( task ):
+    source_positions, target_positions, weights, community_codes, K, chunks, max_cells = task
+    matrices = [ _shuffled_contingency_matrices( source_positions, target_positions, weights, community_codes, K, size, seed, max_cells ) 
+                    for (size, seed) in chunks ]
+    return np.concatenate( matrices ) if matrices else np.zeros( (0, K, K) )
+
+def encode_edgelist( edgelist, user_ids, source='source', target='target' ):
+    '''Returns a copy of edgelist with the source and target users replaced by their IDs in user_ids:UserDictionary.
+    Edgelists whose source and target are already integer IDs are returned as they are.
+    '''
+    if (edgelist[ source ].dtype.kind in 'iu') and (edgelist[ target ].dtype.kind in 'iu'):
+        return edgelist
+
+    edgelist = edgelist.copy()
+    edgelist[ source ] = user_ids.encode( edgelist[ source ] )
+    edgelist[ target ] = user_ids.encode( edgelist[ target ] )
+    return edgelist
+
+def encode_partition( partition, user_ids ):
+    '''Returns partition:dict{user:community} keyed by the IDs of the users in user_ids:UserDictionary (unknown users are dropped).
+    '''
+    ids = user_ids.encode( list( partition.keys() ) )
+    return { int(i): comm for (i, comm) in zip( ids, partition.values() ) if i >= 0 }
+
+def encode_community( users, user_ids ):
+    if isinstance( users, np.ndarray ) and users.dtype.kind in 'iu':
+        return users
+    return user_ids.encode_set( users )
+
 def get_users_in_community( partition, community ):
     return [user for (user, comm) in partition.items() if comm == community]
 
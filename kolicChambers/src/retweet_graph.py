@@ -0,0 +1,285 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+###################### INTEGER-INDEXED RETWEET GRAPH ######################
+class RetweetGraph:
+    '''Compact retweet graph of a single week, built once from its edgelist.
+
+    User names are interned to int32 codes (`users[code] -> name`, `user_index[name] -> code`), and the edges are
+    stored as CSR out-adjacency (source -> targets) and CSR in-adjacency (target -> sources) arrays.
+    A graph over the users of a week only can still use global user IDs: `ids[code] -> ID` (sorted) maps its codes to them.
+    '''
+
+    def __init__( self, users, sources, targets, weights, user_index=None, global_ids=False, ids=None ):
+
+        self.users = np.asarray( users )
+        # the name -> code dict can be shared by graphs over the same users (e.g. a global user dictionary)
+        if user_index is None:
+            user_index = dict( zip( self.users, range( len(self.users) ) ) )
+        self.user_index = user_index
+        # if the codes are global user IDs (see user_dictionary.UserDictionary), sets of users are returned as sorted ID arrays
+        self.global_ids = global_ids or ( ids is not None )
+        self.ids = None if ids is None else np.asarray( ids )
+
+        # edge arrays can be memory-mapped or in shared memory, they are never copied here
+        self.sources = np.asarray( sources, dtype=np.int32 )
+        self.targets = np.asarray( targets, dtype=np.int32 )
+        self.weights = np.asarray( weights )
+
+        # CSR arrays are built on first use
+        self._out_csr = None
+        self._in_csr = None
+
+    @property
+    def out_indptr( self ):
+        return self._out()[0]
+
+    @property
+    def out_indices( self ):
+        return self._out()[1]
+
+    @property
+    def out_edges( self ):
+        return self._out()[2]
+
+    @property
+    def in_indptr( self ):
+        return self._in()[0]
+
+    @property
+    def in_indices( self ):
+        return self._in()[1]
+
+    @property
+    def in_edges( self ):
+        return self._in()[2]
+
+    def _out( self ):
+        if self._out_csr is None:
+            self._out_csr = _csr_arrays( self.sources, self.targets, self.num_users )
+        return self._out_csr
+
+    def _in( self ):
+        if self._in_csr is None:
+            self._in_csr = _csr_arrays( self.targets, self.sources, self.num_users )
+        return self._in_csr
+
+    @property
+    def num_users( self ):
+        return len( self.users )
+
+    @property
+    def num_edges( self ):
+        return len( self.sources )
+
+    def code( self, user ):
+        '''Returns the int code of `user`, or -1 if it is not in the graph.
+        '''
+        code = self.user_index.get( user, -1 )
+        # a shared user_index (see user_dictionary.UserDictionary) can grow after the graph is built
+        return code if code < self.num_users else -1
+
+    def encode( self, users ):
+        '''Returns the int codes of the `users` present in the graph (unknown users are dropped).
+        If the graph uses global IDs, `users` can also be an array of IDs.
+        '''
+        if self.global_ids and isinstance( users, np.ndarray ) and users.dtype.kind in 'iu':
+            if self.ids is not None:
+                if self.num_users == 0:
+                    return np.zeros( 0, dtype=np.int32 )
+                codes = np.minimum( np.searchsorted( self.ids, users ), self.num_users - 1 )
+                return codes[ self.ids[ codes ] == users ].astype( np.int32 )
+            return users[ ( users >= 0 ) & ( users < self.num_users ) ].astype( np.int32 )
+
+        codes = np.array( [ self.user_index[u] for u in users if u in self.user_index ], dtype=np.int32 )
+        return codes[ codes < self.num_users ]
+
+    def decode( self, codes ):
+        '''Returns the set of user names of the int `codes`, or their sorted unique array if the graph uses global IDs.
+        '''
+        if self.global_ids:
+            if self.ids is not None:
+                return np.unique( self.ids[ codes ] ).astype( np.int32 )
+            return np.unique( codes ).astype( np.int32 )
+        return set( self.users[ codes ] )
+
+    def in_neighbours( self, codes ):
+        '''Returns the (unique) codes of the users retweeting any of the users in `codes`. O(in-degree).
+        '''
+        return np.unique( _gather( self.in_indptr, self.in_indices, codes ) )
+
+    def out_neighbours( self, codes ):
+        '''Returns the (unique) codes of the users retweeted by any of the users in `codes`. O(out-degree).
+        '''
+        return np.unique( _gather( self.out_indptr, self.out_indices, codes ) )
+
+    def adjacency_matrix( self ):
+        '''Returns the binary sparse (csr) adjacency matrix A with A[i,j] = 1 if user i retweets user j.
+        '''
+        A = sp.csr_matrix( 
+                ( np.ones( self.num_edges, dtype=np.int32 ), ( self.sources, self.targets ) ), 
+                shape=( self.num_users, self.num_users ) 
+                )
+        # repeated edges are summed up by scipy, keep the pattern only
+        A.data[:] = 1
+        return A
+
+    def edges_among( self, codes ):
+        '''Returns the (sorted) positions of the edges with both endpoints in `codes`. O(out-degree of codes).
+        '''
+        members = np.zeros( self.num_users, dtype=bool )
+        members[ codes ] = True
+
+        # out-edges of the members, kept if their target is a member too
+        edges = _gather( self.out_indptr, self.out_edges, np.flatnonzero( members ) )
+        return np.sort( edges[ members[ self.targets[ edges ] ] ] )
+
+    def subnetwork( self, codes ):
+        '''Returns the SubNetworkView of the edges among the users in `codes`.
+        '''
+        codes = np.unique( np.asarray( codes, dtype=np.int32 ) )
+        return SubNetworkView( self, self.edges_among( codes ), codes )
+
+    def to_edgelist( self, edges=None, source='source', target='target', weight='weight' ):
+        '''Returns the (sub)edgelist:dataframe with the edges in positions `edges` (all of them if None).
+        '''
+        if edges is None:
+            edges = slice( None )
+
+        return pd.DataFrame( {
+            source: self.users[ self.sources[ edges ] ],
+            target: self.users[ self.targets[ edges ] ],
+            weight: self.weights[ edges ],
+        } )
+
+
+class SubNetworkView:
+    '''Zero-copy view of the sub-network of a RetweetGraph among a set of users (e.g. a chamber or an audience).
+
+    Only the sorted positions of its edges in the week's edge arrays (and the codes of its users) are stored; the edgelist is
+    materialized on demand with to_dataframe or to_networkx, and the aggregate statistics are computed on the view.
+    '''
+
+    def __init__( self, graph, edges, codes ):
+        self.graph = graph
+        self.edges = edges
+        self.codes = codes
+
+    def __len__( self ):
+        return self.n_edges
+
+    @property
+    def n_edges( self ):
+        return len( self.edges )
+
+    @property
+    def n_users( self ):
+        return len( self.codes )
+
+    @property
+    def density( self ):
+        '''Returns edges / (users * (users - 1)) of the directed sub-network (0 for less than 2 users).
+        '''
+        if self.n_users < 2:
+            return 0
+        return self.n_edges / ( self.n_users * ( self.n_users - 1 ) )
+
+    @property
+    def weight_sum( self ):
+        return self.graph.weights[ self.edges ].sum()
+
+    @property
+    def sources( self ):
+        return self.graph.sources[ self.edges ]
+
+    @property
+    def targets( self ):
+        return self.graph.targets[ self.edges ]
+
+    @property
+    def weights( self ):
+        return self.graph.weights[ self.edges ]
+
+    def to_dataframe( self, source='source', target='target', weight='weight' ):
+        '''Returns the edgelist:dataframe of the sub-network.
+        '''
+        return self.graph.to_edgelist( self.edges, source=source, target=target, weight=weight )
+
+    def to_networkx( self, weight='weight' ):
+        '''Returns the sub-network as a networkx.DiGraph with `weight` edge attributes (requires networkx).
+        '''
+        import networkx as nx
+
+        G = nx.DiGraph()
+        G.add_nodes_from( self.graph.users[ self.codes ] )
+        G.add_weighted_edges_from( zip( self.graph.users[ self.sources ], self.graph.users[ self.targets ], self.weights ), weight=weight )
+        return G
+
+    def bind( self, graph ):
+        '''Attaches the view to graph (the same week), e.g. after it was sent back from a worker process.
+        '''
+        self.graph = graph
+        return self
+
+    def __getstate__( self ):
+        # the week's graph is not pickled with every view
+        return { 'graph': None, 'edges': self.edges, 'codes': self.codes }
+
+
+def build_retweet_graph( edgelist, source='source', target='target', weight='weight', user_ids=None ):
+    '''Returns the RetweetGraph of `edgelist`. If the edgelist has no `weight` column, every edge has weight 1.
+    If user_ids:UserDictionary is given, the codes of the graph are the global user IDs (new users are added to user_ids).
+    '''
+
+    endpoints = pd.concat( [ edgelist[ source ], edgelist[ target ] ], ignore_index=True )
+    if user_ids is None:
+        codes, users = pd.factorize( endpoints )
+        users, user_index = np.asarray( users ), None
+    else:
+        codes = user_ids.add( endpoints )
+        users, user_index = user_ids.labels, user_ids.index
+    codes = codes.astype( np.int32 )
+
+    num_edges = len( edgelist )
+    if weight in edgelist.columns:
+        weights = edgelist[ weight ].to_numpy()
+    else:
+        weights = np.ones( num_edges, dtype=np.int32 )
+
+    return RetweetGraph( users, codes[ :num_edges ], codes[ num_edges: ], weights, user_index=user_index, global_ids=user_ids is not None )
+
+def as_retweet_graph( edgelist, source='source', target='target', weight='weight', user_ids=None ):
+    '''Returns `edgelist` if it is already a RetweetGraph, otherwise builds it.
+    '''
+    if isinstance( edgelist, RetweetGraph ):
+        if (user_ids is not None) and (edgelist.user_index is not user_ids.index):
+            raise ValueError( "The RetweetGraph was not built with the given user_ids dictionary." )
+        return edgelist
+    return build_retweet_graph( edgelist, source=source, target=target, weight=weight, user_ids=user_ids )
+
+## Helpers
+def _csr_arrays( rows, cols, num_rows ):
+    '''Returns (indptr, indices, edge positions) of the CSR arrays of the edges rows[k] -> cols[k].
+    '''
+    order = np.argsort( rows, kind='stable' )
+    indptr = np.zeros( num_rows + 1, dtype=np.int64 )
+    np.cumsum( np.bincount( rows, minlength=num_rows ), out=indptr[1:] )
+
+    return indptr, cols[ order ], order
+
+def _gather( indptr, indices, rows ):
+    '''Concatenates indices[ indptr[r]:indptr[r+1] ] for every r in rows without a python loop.
+    '''
+    rows = np.asarray( rows, dtype=np.int64 )
+    starts = indptr[ rows ]
+    lengths = indptr[ rows + 1 ] - starts
+
+    total = lengths.sum()
+    if total == 0:
+        return indices[ :0 ]
+
+    # position k of the output belongs to row j and reads indices[ starts[j] + (k - offsets[j]) ]
+    offsets = np.cumsum( lengths ) - lengths
+    positions = np.repeat( starts - offsets, lengths ) + np.arange( total )
+    return indices[ positions ]
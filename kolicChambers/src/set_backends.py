@@ -0,0 +1,108 @@
+import numpy as np
+
+try:
+    from pyroaring import BitMap
+except ImportError:
+    BitMap = None
+
+###################### SET BACKENDS FOR AUDIENCES, CHAMBERS AND ECHO CHAMBERS ######################
+# Sets of users can be represented as:
+#   - 'python':  python sets of users (names or IDs)
+#   - 'array':   sorted int32 arrays of global user IDs (see user_dictionary.UserDictionary)
+#   - 'roaring': compressed roaring bitmaps of global user IDs (requires pyroaring). Unions and intersection cardinalities run
+#                in native code without copying, and echo chambers of millions of users take a few MB.
+# The functions below infer the representation from their inputs, so any module can take any of them.
+
+BACKENDS = ['python', 'array', 'roaring']
+
+def backend_of( users ):
+    '''Returns the name of the backend of users (a set, an ID array or a bitmap).
+    '''
+    if isinstance( users, np.ndarray ):
+        return 'array'
+    if BitMap is not None and isinstance( users, BitMap ):
+        return 'roaring'
+    return 'python'
+
+def is_id_array( users ):
+    return backend_of( users ) == 'array'
+
+def to_backend( users, backend ):
+    '''Returns users:(set, ID array or bitmap) in the representation of `backend`. Bitmaps and arrays require int user IDs.
+    '''
+    if backend is None or backend_of( users ) == backend:
+        return users
+
+    if backend == 'python':
+        return set( to_id_array( users ).tolist() ) if backend_of( users ) == 'roaring' else set( users.tolist() )
+
+    ids = to_id_array( users )
+    if backend == 'array':
+        return ids
+    if backend == 'roaring':
+        _check_roaring()
+        return BitMap( ids )
+
+    raise ValueError( "backend {} not understood. Can be one of {}.".format( backend, BACKENDS ) )
+
+def to_id_array( users ):
+    '''Returns the sorted int32 ID array of users:(set of int IDs, ID array or bitmap).
+    '''
+    backend = backend_of( users )
+    if backend == 'array':
+        return users
+    if backend == 'roaring':
+        return np.array( users.to_array(), dtype=np.int32 )
+
+    ids = np.fromiter( users, dtype=np.int64, count=len(users) ) if len(users) > 0 else np.zeros( 0, dtype=np.int64 )
+    return np.unique( ids ).astype( np.int32 )
+
+def convert_sets( sets_dict, backend ):
+    '''Returns sets_dict:dict{key:users} with every set of users in the representation of `backend`.
+    '''
+    return { key: to_backend( users, backend ) for (key, users) in sets_dict.items() }
+
+def empty_set( backend ):
+    if backend == 'array':
+        return np.zeros( 0, dtype=np.int32 )
+    if backend == 'roaring':
+        _check_roaring()
+        return BitMap()
+    return set()
+
+## SET OPERATIONS
+def intersection_size( U, V ):
+    '''Returns |U ∩ V| for two sets of users of the same backend, without materializing the intersection for bitmaps.
+    '''
+    backend = backend_of( U )
+    if backend == 'array':
+        return len( np.intersect1d( U, V, assume_unique=True ) )
+    if backend == 'roaring':
+        return U.intersection_cardinality( V )
+    return len( U.intersection( V ) )
+
+def union_all( sets, backend=None ):
+    '''Returns the union of all the sets of users in `sets`, computed once rather than with pairwise copying unions.
+    The backend is inferred from the sets if not given.
+    '''
+    sets = list( sets )
+    if backend is None:
+        backend = backend_of( sets[0] ) if len( sets ) > 0 else 'python'
+
+    if len( sets ) == 0:
+        return empty_set( backend )
+
+    if backend == 'array':
+        return np.unique( np.concatenate( sets ) ).astype( np.int32 )
+    if backend == 'roaring':
+        return BitMap.union( *sets )
+
+    union = set()
+    for users in sets:
+        union.update( users )
+    return union
+
+## Helpers
+def _check_roaring():
+    if BitMap is None:
+        raise ImportError( "The 'roaring' set backend requires pyroaring (pip install pyroaring)." )
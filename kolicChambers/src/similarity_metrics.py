@@ -1,8 +1,14 @@
+import functools
 import itertools
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 # local
 import chambers_and_audiences as ca
+import minhash as mh
+import retweet_graph as rg
+import set_backends as sb
+import weekly_pool as wp
 
 from scipy.signal import argrelextrema
 from scipy.stats import gaussian_kde
@@ -10,31 +16,49 @@ from scipy.stats import gaussian_kde
 ###################### OVERLAP SIMILARITY BETWEEN LEADING (PERSISTENT) USERS ######################
 
 def jaccard_similarity(U, V):
-    """Return Jaccard similarity between sets U and V.
+    """Return Jaccard similarity between sets U and V (or ID arrays/bitmaps, see set_backends).
     """
     
-    UintV = len( U.intersection(V) )
+    UintV = sb.intersection_size( U, V )
     if UintV == 0:
         return np.nan
     else:
         return UintV/(len(U) + len(V) - UintV) # ~len( U.union(V) ) 
 
 def szymkiewicz_simpson_similarity(U, V):
-    """Return Szymkiewicz–Simpson similarity between sets U and V.
+    """Return Szymkiewicz–Simpson similarity between sets U and V (or ID arrays/bitmaps, see set_backends).
     """
     
-    UintV = len( U.intersection(V) )
+    UintV = sb.intersection_size( U, V )
     if UintV == 0:
         return np.nan
     else:
         return UintV/(min(len(U),len(V))) # ~len( U.union(V) ) 
 
+# similarity functions with a vectorized (sparse) implementation
+SPARSE_SIMILARITIES = {
+    jaccard_similarity: 'jaccard',
+    szymkiewicz_simpson_similarity: 'szymkiewicz_simpson',
+}
 
-def similarity_matrix(chambers, similarity_func=jaccard_similarity ):
+
+def similarity_matrix(chambers, similarity_func=jaccard_similarity, vectorized=True, approximate=False, **minhash_kw ):
     """ Returns the similarity matrix of the chambers:list[set] given a similarity_func:function.
     If no similarity function is specified, it return the Jaccard similarity of the chambers.
     If a similarity function is passed, it should receive two sets as arguments and return a number.
+    If vectorized and similarity_func is jaccard_similarity or szymkiewicz_simpson_similarity, all the pairwise intersections 
+    are computed at once with sparse matrices (see sparse_similarity_matrix).
+    If approximate, the Jaccard similarity is estimated from MinHash signatures; minhash_kw (num_perm, max_error, lsh_threshold, seed) 
+    are passed to minhash.minhash_similarity_matrix.
     """
+
+    if approximate:
+        if similarity_func is not jaccard_similarity:
+            raise ValueError( "The approximate similarity matrix is only available for jaccard_similarity." )
+        return mh.minhash_similarity_matrix( chambers, **minhash_kw )
+
+    if vectorized and similarity_func in SPARSE_SIMILARITIES:
+        return sparse_similarity_matrix( chambers, metric=SPARSE_SIMILARITIES[ similarity_func ] )
     
     similarities = np.zeros( [len(chambers), len(chambers)] )
 
@@ -53,12 +77,77 @@ def similarity_matrix(chambers, similarity_func=jaccard_similarity ):
 
     return pd.DataFrame( similarities, index=chambers.keys(), columns=chambers.keys() )
 
-def temporal_similarity_matrices(temporal_chambers, similarity_func=jaccard_similarity, order_by_communities=True, resolution=1, partition=None):
+def sparse_similarity_matrix(chambers, metric='jaccard'):
+    """ Returns the similarity matrix of the chambers:dict{user:set} for metric in {'jaccard', 'szymkiewicz_simpson'}.
+    The chambers are encoded as a sparse (users x members) incidence matrix X so that every pairwise intersection is in X @ X.T.
+    As in jaccard_similarity, pairs with an empty intersection are NaN, and the diagonal is 0.
+    """
+
+    X = chambers_incidence_matrix( chambers )
+    sizes = np.asarray( X.sum(axis=1) ).ravel()
+
+    intersections = sp.triu( X @ X.T, k=1 ).tocoo()
+    UintV = intersections.data.astype( float )
+    i, j = intersections.row, intersections.col
+
+    if metric == 'jaccard':
+        values = UintV/( sizes[i] + sizes[j] - UintV )
+    elif metric == 'szymkiewicz_simpson':
+        values = UintV/np.minimum( sizes[i], sizes[j] )
+    else:
+        raise ValueError( "metric {} not understood. Can be 'jaccard' or 'szymkiewicz_simpson'.".format(metric) )
+
+    similarities = np.full( [len(chambers), len(chambers)], np.nan )
+    np.fill_diagonal( similarities, 0 )
+    similarities[i,j] = values
+    similarities[j,i] = values
+
+    return pd.DataFrame( similarities, index=chambers.keys(), columns=chambers.keys() )
+
+def chambers_incidence_matrix(chambers, members=None):
+    """ Returns the sparse (csr) incidence matrix X of chambers:dict{user:set}, where X[i,k] = 1 if members[k] is in the i-th chamber.
+    If members:pd.Index is None, it is built from the union of all the chambers.
+    If the chambers are arrays or bitmaps of global user IDs (see set_backends), the IDs are used as columns directly.
+    """
+
+    sizes = [ len(C) for C in chambers.values() ]
+
+    if len(chambers) > 0 and sb.backend_of( next( iter( chambers.values() ) ) ) != 'python':
+        cols = np.concatenate( [ sb.to_id_array( C ) for C in chambers.values() ] ).astype( np.int64 )
+        rows = np.repeat( np.arange( len(chambers) ), sizes )
+        return sp.csr_matrix( 
+                ( np.ones( len(cols), dtype=np.int32 ), ( rows, cols ) ), 
+                shape=( len(chambers), cols.max() + 1 if len(cols) else 0 ) 
+                )
+    all_members = np.array( [ m for C in chambers.values() for m in C ], dtype=object )
+
+    if members is None:
+        cols, members = pd.factorize( all_members )
+    else:
+        cols = members.get_indexer( all_members )
+
+    rows = np.repeat( np.arange( len(chambers) ), sizes )
+    known = cols >= 0
+    X = sp.csr_matrix( 
+            ( np.ones( known.sum(), dtype=np.int32 ), ( rows[known], cols[known] ) ), 
+            shape=( len(chambers), len(members) ) 
+            )
+    return X
+
+def temporal_similarity_matrices(temporal_chambers, similarity_func=jaccard_similarity, order_by_communities=True, resolution=1, partition=None, approximate=False, n_jobs=None, executor=None, **minhash_kw):
+    """ Returns the similarity matrix of the chambers of every week in temporal_chambers:list[dict]. See ?similarity_matrix for 
+    the approximate (MinHash) mode.
+    If n_jobs or executor are given, the weekly matrices are computed in parallel over a process pool.
+    """
+
+    weekly_similarity = functools.partial( similarity_matrix, similarity_func=similarity_func, approximate=approximate, **minhash_kw )
+    if (n_jobs is not None) or (executor is not None):
+        weekly_Q = wp.map_items( weekly_similarity, temporal_chambers, n_jobs=n_jobs, executor=executor )
+    else:
+        weekly_Q = map( weekly_similarity, temporal_chambers )
     
     similarity_matrices = []
-    for chambers in temporal_chambers:
-
-        Q = similarity_matrix(chambers, similarity_func=similarity_func)
+    for Q in weekly_Q:
         
         if order_by_communities:
             if partition is None:
@@ -85,9 +174,12 @@ def aggregate_similarity_matrices( temporal_similarities ):
 
 
 ## AUDIENCE VS CHAMBER DEDICATED METHOD
-def temporal_subchambers_overlaps(audiences, edgelists, users_excluded=False, removal_ratio='intersection', order_by_communities=True, partition=None, resolution=1, source='source', target='target'):
+def temporal_subchambers_overlaps(audiences, edgelists, users_excluded=False, removal_ratio='intersection', order_by_communities=True, partition=None, resolution=1, source='source', target='target', n_jobs=None, executor=None):
     """Returns overlap matrices for every week in edgelists based on the subchambers with some members of the audience removed. 
     By default, for every pairs of users i & j, this method removes their common audience members to construct their chambers.
+
+    The audience member -> retweeted users index (the out-adjacency of the week's RetweetGraph) is built once per week, and the 
+    audiences are never modified. If n_jobs or executor are given, the pairs of each week are split over a process pool.
     """
     assert len(audiences) == len(edgelists), "audiences and edgelists are not of the same size"
 
@@ -102,40 +194,37 @@ def temporal_subchambers_overlaps(audiences, edgelists, users_excluded=False, re
     # loop through every week
     for (t, edgelist) in enumerate(edgelists):
 
-        users = audiences[t].keys()
+        graph = rg.as_retweet_graph( edgelist, source=source, target=target )
+
+        users = list( audiences[t].keys() )
+        user_codes = np.array( [ graph.code( u ) for u in users ] )
+        audience_codes = [ np.unique( graph.encode( audiences[t][u] ) ) for u in users ]
+
+        excluded = users_excluded[t] if list_of_lists else users_excluded
+        excluded_codes = graph.encode( excluded ) if excluded != False else np.zeros( 0, dtype=np.int32 )
+
+        # pairs i < j
+        I, J = np.triu_indices( len(users), k=1 )
+        remove_intersection = removal_ratio == 'intersection' # TODO: pick random sample based on ratio otherwise
+
+        if (n_jobs is not None) or (executor is not None):
+            num_chunks = max( 1, min( len(I), 4*(n_jobs or 1) ) )
+            chunk_args = [ ( audience_codes, user_codes, excluded_codes, I_k, J_k, remove_intersection ) 
+                          for (I_k, J_k) in zip( np.array_split( I, num_chunks ), np.array_split( J, num_chunks ) ) ]
+            similarities = wp.map_week_chunks( _subchamber_similarities, graph, chunk_args, n_jobs=n_jobs, executor=executor )
+            similarities = np.concatenate( similarities ) if similarities else np.zeros( 0 )
+        else:
+            similarities = _subchamber_similarities( graph, audience_codes, user_codes, excluded_codes, I, J, remove_intersection )
+
         Q = np.zeros( [ len(users), len(users) ] )
-    
-        # loop through every pair of users
-        for (i,u) in enumerate( users ):
-            for (j,v) in enumerate( users ):
-                if i < j:
-
-                    Au = audiences[t][u]
-                    Av = audiences[t][v]
-
-                    if removal_ratio == 'intersection':
-                        #remove intersection
-                        Au -= Av 
-                        Av -= Au
-                    else: # removal ratio is a number in (0,1)
-                        #TODO: pick random sample based on ratio
-                        pass
-                
-                    if list_of_lists:
-                        Cu = ca.get_chamber_from_audience( u, edgelist, Au, users_excluded=users_excluded[t], source=source, target=target )
-                        Cv = ca.get_chamber_from_audience( v, edgelist, Av, users_excluded=users_excluded[t], source=source, target=target )
-                    else:
-                        Cu = ca.get_chamber_from_audience( u, edgelist, Au, users_excluded=users_excluded, source=source, target=target )
-                        Cv = ca.get_chamber_from_audience( v, edgelist, Av, users_excluded=users_excluded, source=source, target=target )
-
-                    Q[i,j] = jaccard_similarity(Cu,Cv)
-                    Q[j,i] = Q[i,j]
-                    
+        Q[I,J] = similarities
+        Q[J,I] = similarities
             
         # transform similarity matrix intro a named dataframe
         Q = pd.DataFrame( Q, index=users, columns=users )
         
         # order entries of similarity matrix by community membership
+        P = None
         if order_by_communities:
             if partition is None:
                 pass
@@ -149,6 +238,37 @@ def temporal_subchambers_overlaps(audiences, edgelists, users_excluded=False, re
 
     return temporal_subchambers_similarities
 
+# helper (top-level so it can be sent to worker processes)
+def _subchamber_similarities(graph, audience_codes, user_codes, excluded_codes, I, J, remove_intersection=True):
+    """Returns the Jaccard similarity of the subchambers of the pairs of users (I[k], J[k]) given their audiences as int codes of graph.
+    """
+
+    excluded = np.zeros( graph.num_users, dtype=bool )
+    excluded[ excluded_codes ] = True
+
+    def subchamber( audience, user_code ):
+        chamber = graph.out_neighbours( audience )
+        return chamber[ ~excluded[ chamber ] & ( chamber != user_code ) ]
+
+    similarities = np.zeros( len(I) )
+    for (k, (i,j)) in enumerate( zip(I, J) ):
+
+        Au = audience_codes[i]
+        Av = audience_codes[j]
+        if remove_intersection:
+            Au, Av = np.setdiff1d( Au, Av, assume_unique=True ), np.setdiff1d( Av, Au, assume_unique=True )
+
+        Cu = subchamber( Au, user_codes[i] )
+        Cv = subchamber( Av, user_codes[j] )
+
+        CuintCv = len( np.intersect1d( Cu, Cv, assume_unique=True ) )
+        if CuintCv == 0:
+            similarities[k] = np.nan
+        else:
+            similarities[k] = CuintCv/( len(Cu) + len(Cv) - CuintCv )
+
+    return similarities
+
 
 ## COMMUNITY RELATED ## 
 def reorder_similarity_matrix(similarity_matrix, partition=None):
@@ -0,0 +1,136 @@
+import os
+import numpy as np
+import pandas as pd
+
+###################### GLOBAL USER-ID DICTIONARY ######################
+class UserDictionary:
+    '''Append-only dictionary mapping every user of the corpus to a dense int ID (user -> ID, and ID -> user).
+
+    IDs never change once assigned, so sets of users of any week can be stored as sorted int ID arrays or bitmaps 
+    (see set_backends) that all the modules (chambers_and_audiences, echo_chambers, polarization, similarity_metrics) agree on.
+    '''
+
+    def __init__( self, users=() ):
+        self.index = dict()
+        # labels live in a buffer grown by doubling, and the vectorized lookups run over a few pd.Index segments of
+        # geometrically decreasing sizes (see _add_segment), so the dictionary is never rebuilt as a whole when it grows
+        self._buffer = np.empty( 0, dtype=object )
+        self._size = 0
+        self._segments = []  # (offset of the first ID, pd.Index of the labels of the segment)
+        self.add( users )
+
+    def __len__( self ):
+        return self._size
+
+    def __contains__( self, user ):
+        return user in self.index
+
+    @property
+    def labels( self ):
+        '''Returns the array of users, where labels[ID] is the user with that ID.
+        '''
+        return self._buffer[ :self._size ]
+
+    @property
+    def users( self ):
+        return self.labels
+
+    def add( self, users ):
+        '''Adds the unknown users in `users` to the dictionary and returns the IDs of all of them.
+        '''
+        users = _as_array( users )
+        if len( users ) == 0:
+            return np.zeros( 0, dtype=np.int32 )
+
+        ids = self._get_indexer( users )
+        unknown = ids < 0
+        if unknown.any():
+            new_users = pd.unique( users[ unknown ] )
+            start = self._size
+            self._append( new_users )
+            ids[ unknown ] = pd.Index( new_users ).get_indexer( users[ unknown ] ) + start
+            self._add_segment( start )
+
+        return ids.astype( np.int32 )
+
+    def encode( self, users ):
+        '''Returns the IDs of `users`, with -1 for the users that are not in the dictionary.
+        '''
+        users = _as_array( users )
+        if len( users ) == 0:
+            return np.zeros( 0, dtype=np.int32 )
+        return self._get_indexer( users ).astype( np.int32 )
+
+    def encode_set( self, users ):
+        '''Returns the sorted array with the (unique) IDs of the known users in users:set.
+        '''
+        ids = self.encode( users )
+        return np.unique( ids[ ids >= 0 ] )
+
+    def decode( self, ids ):
+        '''Returns the array of users with IDs `ids`.
+        '''
+        return self.labels[ np.asarray( ids, dtype=np.int64 ) ]
+
+    def decode_set( self, ids ):
+        '''Returns the set of users with IDs `ids`.
+        '''
+        return set( self.decode( ids ) )
+
+    def save( self, path ):
+        '''Saves the dictionary as a fixed-width .npy array (memory-mappable, no pickle).
+        '''
+        users = self.labels
+        kind = pd.api.types.infer_dtype( users, skipna=False )
+        if kind in ( 'string', 'empty' ):
+            users = users.astype( str )
+        elif kind == 'integer':
+            users = users.astype( np.int64 )
+        else:
+            raise ValueError( "The users must be all strings or all integers to be saved, found {}.".format( kind ) )
+        np.save( path, users, allow_pickle=False )
+
+    @classmethod
+    def load( cls, path ):
+        '''Returns the UserDictionary saved at `path` (see UserDictionary.save), or an empty one if there is no such file.
+        '''
+        if not os.path.exists( path ):
+            return cls()
+        return cls( np.load( path, allow_pickle=False ).tolist() )
+
+    def _get_indexer( self, users ):
+        ids = np.full( len( users ), -1, dtype=np.int64 )
+        missing = np.arange( len( users ) )
+        for ( offset, segment ) in self._segments:
+            if len( missing ) == 0:
+                break
+            positions = segment.get_indexer( users[ missing ] )
+            found = positions >= 0
+            ids[ missing[ found ] ] = positions[ found ] + offset
+            missing = missing[ ~found ]
+        return ids
+
+    def _append( self, new_users ):
+        size = self._size + len( new_users )
+        if size > len( self._buffer ):
+            buffer = np.empty( max( size, 2*len( self._buffer ), 1024 ), dtype=object )
+            buffer[ :self._size ] = self._buffer[ :self._size ]
+            self._buffer = buffer
+
+        self._buffer[ self._size:size ] = new_users
+        self.index.update( zip( new_users, range( self._size, size ) ) )
+        self._size = size
+
+    def _add_segment( self, start ):
+        # the new users form a segment, merged with the previous segments that are not larger, so segment sizes decrease
+        # geometrically: there are O(log users) segments and every user is re-indexed O(log users) times
+        offset = start
+        while self._segments and ( self._size - offset ) >= ( offset - self._segments[-1][0] ):
+            offset = self._segments.pop()[0]
+        self._segments.append( ( offset, pd.Index( self._buffer[ offset:self._size ] ) ) )
+
+## Helpers
+def _as_array( users ):
+    if isinstance( users, ( np.ndarray, pd.Series, pd.Index, pd.Categorical ) ):
+        return np.asarray( users, dtype=object )
+    return np.array( list( users ), dtype=object )
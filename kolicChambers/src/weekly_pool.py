@@ -0,0 +1,205 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+# local
+from retweet_graph import RetweetGraph, as_retweet_graph
+
+###################### PROCESS POOL OVER WEEKLY NETWORKS ######################
+# Every week is independent, so the weeks are fanned out over a process pool. The edge arrays of each week are placed in
+# shared memory once and the workers attach to them, so that no edgelist dataframe is pickled to the workers.
+# Graphs over a global UserDictionary carry the labels of every user of the corpus: they are shared once per pool call too,
+# and every worker decodes them (and builds their label index) once per pool call instead of once per week.
+
+def map_weeks( func, edgelists, week_args, n_jobs=None, executor=None, source='source', target='target', weight='weight', user_ids=None ):
+    '''Returns [ func( graph_t, *week_args[t] ) for every week t ] computed over a process pool, in temporal order.
+
+    - func: top-level (picklable) function receiving the RetweetGraph of the week as its first argument.
+    - edgelists: list of edgelists (dataframes or RetweetGraphs) ordered temporally.
+    - week_args: list of tuples with the extra arguments of func for every week.
+    - n_jobs: number of worker processes (ignored if an executor is given).
+    - executor: optional concurrent.futures executor to use instead of a new ProcessPoolExecutor.
+    - user_ids: optional UserDictionary used to build the graphs (see retweet_graph.build_retweet_graph).
+
+    The graph of a week is only built (and shared) when a slot is free: at most 2*n_jobs weeks are in flight, and the shared
+    memory of every week is released as soon as its result is back, so memory does not grow with the number of weeks.
+    '''
+
+    assert len(edgelists) == len(week_args), "edgelists and week_args are not of the same size"
+
+    shared_blocks = []  # blocks shared by all the weeks
+    in_flight = dict()  # future -> (week, blocks of the week)
+    results = [ None ]*len(edgelists)
+    max_in_flight = 2*( n_jobs or os.cpu_count() or 1 )
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor( max_workers=n_jobs )
+
+    def collect( futures ):
+        for future in futures:
+            t, blocks = in_flight.pop( future )
+            _release( blocks )
+            results[t] = future.result()
+
+    try:
+        labels = None
+        if user_ids is not None:
+            # the users of every week are added first, so the (append-only) labels are complete and shared once
+            for edgelist in edgelists:
+                if not isinstance( edgelist, RetweetGraph ):
+                    user_ids.add( pd.concat( [ edgelist[ source ], edgelist[ target ] ], ignore_index=True ) )
+            blocks, labels = share_labels( user_ids.labels )
+            shared_blocks += blocks
+
+        for (t, (edgelist, args)) in enumerate( zip( edgelists, week_args ) ):
+
+            while len( in_flight ) >= max_in_flight:
+                collect( wait( in_flight, return_when=FIRST_COMPLETED ).done )
+
+            graph = as_retweet_graph( edgelist, source=source, target=target, weight=weight, user_ids=user_ids )
+            blocks, descriptor = share_graph( graph, labels=labels )
+            del graph
+
+            in_flight[ executor.submit( _run_on_shared_week, func, descriptor, args ) ] = ( t, blocks )
+
+        while in_flight:
+            collect( wait( in_flight, return_when=FIRST_COMPLETED ).done )
+
+        # results are stored by week, so they come back in temporal order
+        return results
+
+    finally:
+        for future in in_flight:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
+        for (_, blocks) in in_flight.values():
+            _release( blocks )
+        _release( shared_blocks )
+
+def map_week_chunks( func, edgelist, chunk_args, n_jobs=None, executor=None, source='source', target='target', weight='weight' ):
+    '''Returns [ func( graph, *args ) for args in chunk_args ] computed over a process pool for a single week, in the order of chunk_args.
+    The edge arrays of the week are placed in shared memory once and shared by all the chunks.
+    '''
+
+    graph = as_retweet_graph( edgelist, source=source, target=target, weight=weight )
+
+    # the global labels of a graph over global IDs (a graph mapped with ids only holds the labels of its week)
+    blocks, labels = share_labels( graph.users ) if graph.global_ids and graph.ids is None else ( [], None )
+    graph_blocks, descriptor = share_graph( graph, labels=labels )
+    blocks += graph_blocks
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor( max_workers=n_jobs )
+
+    try:
+        futures = [ executor.submit( _run_on_shared_week, func, descriptor, args ) for args in chunk_args ]
+        return [ future.result() for future in futures ]
+
+    finally:
+        if own_executor:
+            executor.shutdown()
+        _release( blocks )
+
+def map_items( func, items, n_jobs=None, executor=None ):
+    '''Returns [ func( item ) for item in items ] computed over a process pool, in the order of items.
+    '''
+    if executor is not None:
+        return list( executor.map( func, items ) )
+
+    with ProcessPoolExecutor( max_workers=n_jobs ) as executor:
+        return list( executor.map( func, items ) )
+
+## Shared memory helpers
+def share_graph( graph, labels=None ):
+    '''Copies the edge arrays of graph:RetweetGraph into shared memory blocks.
+    Returns the blocks (to be closed and unlinked by the caller) and the picklable descriptor to attach to them.
+    If labels (see share_labels) holds the global labels of the graph, only the number of users is put in the descriptor.
+    '''
+
+    blocks = []
+    arrays = dict()
+    names = [ 'sources', 'targets', 'weights' ] + ( [ 'ids' ] if graph.ids is not None else [] )
+    for name in names:
+
+        array = getattr( graph, name )
+        block = shared_memory.SharedMemory( create=True, size=max( array.nbytes, 1 ) )
+        np.ndarray( array.shape, dtype=array.dtype, buffer=block.buf )[:] = array
+
+        blocks.append( block )
+        arrays[name] = ( block.name, array.shape, array.dtype.str )
+
+    if labels is not None:
+        return blocks, { 'labels': labels, 'num_users': graph.num_users, 'global_ids': graph.global_ids, 'arrays': arrays }
+    return blocks, { 'users': graph.users, 'global_ids': graph.global_ids, 'arrays': arrays }
+
+def share_labels( labels ):
+    '''Copies the (pickled) array of labels into a shared memory block.
+    Returns the blocks (to be closed and unlinked by the caller) and the picklable reference to read them (see attach_labels).
+    '''
+    data = pickle.dumps( np.asarray( labels ), protocol=pickle.HIGHEST_PROTOCOL )
+    block = shared_memory.SharedMemory( create=True, size=len( data ) )
+    block.buf[ :len( data ) ] = data
+    return [ block ], ( block.name, len( data ) )
+
+def attach_labels( labels ):
+    '''Returns the (labels array, label -> code dict) shared with share_labels. They are decoded once per process and kept
+    until other labels are attached.
+    '''
+    global _attached_labels
+    if _attached_labels[0] != labels:
+
+        block_name, size = labels
+        block = shared_memory.SharedMemory( name=block_name )
+        users = pickle.loads( block.buf[ :size ] )
+        block.close()
+
+        _attached_labels = ( labels, users, dict( zip( users, range( len(users) ) ) ) )
+
+    return _attached_labels[1], _attached_labels[2]
+
+_attached_labels = ( None, None, None )
+
+def attach_graph( descriptor ):
+    '''Returns the RetweetGraph whose edge arrays live in the shared memory blocks of `descriptor` (see share_graph).
+    The blocks are kept in the graph so they stay mapped while the graph is alive.
+    '''
+
+    blocks = []
+    arrays = dict()
+    for (name, (block_name, shape, dtype)) in descriptor['arrays'].items():
+
+        block = shared_memory.SharedMemory( name=block_name )
+        blocks.append( block )
+        arrays[name] = np.ndarray( shape, dtype=np.dtype(dtype), buffer=block.buf )
+
+    if 'labels' in descriptor:
+        users, user_index = attach_labels( descriptor['labels'] )
+        # the labels can hold users added after the graph was built
+        users = users[ :descriptor['num_users'] ]
+    else:
+        users, user_index = descriptor['users'], None
+
+    graph = RetweetGraph( users, arrays['sources'], arrays['targets'], arrays['weights'], user_index=user_index, global_ids=descriptor['global_ids'], ids=arrays.get('ids') )
+    graph._shared_blocks = blocks
+    return graph
+
+def _release( blocks ):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+def _run_on_shared_week( func, descriptor, args ):
+    graph = attach_graph( descriptor )
+    result = func( graph, *args )
+
+    # drop every view on the shared buffers before closing them
+    del graph.sources, graph.targets, graph.weights, graph.ids
+    for block in graph._shared_blocks:
+        block.close()
+
+    return result
@@ -0,0 +1,56 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__ ), '..', 'src' ) )
+
+import chambers_and_audiences as ca
+from chamber_store import ChamberStore, week_fingerprint
+from retweet_graph import build_retweet_graph
+from user_dictionary import UserDictionary
+
+
+def random_edgelist( seed, num_edges=2000, num_users=200 ):
+    rng = np.random.default_rng( seed )
+    return pd.DataFrame( {
+        'source': rng.integers( 0, num_users, num_edges ).astype( str ),
+        'target': rng.integers( 0, num_users//5, num_edges ).astype( str ),
+        'weight': 1,
+    } )
+
+def edge_set( edgelist ):
+    return set( zip( edgelist['source'], edgelist['target'] ) )
+
+
+def test_id_backed_store_networks_match_name_networks():
+    edgelist = random_edgelist( 0 )
+    store = ChamberStore( user_ids=UserDictionary() )
+
+    for user in ['1', '2', '3']:
+        chamber_edgelist = ca.get_chamber_edgelist( user, edgelist, store=store )
+        audience_edgelist = ca.get_audience_edgelist( user, edgelist, store=store )
+
+        assert len( chamber_edgelist ) > 0
+        assert edge_set( chamber_edgelist ) == edge_set( ca.get_chamber_edgelist( user, edgelist ) )
+        assert edge_set( audience_edgelist ) == edge_set( ca.get_audience_edgelist( user, edgelist ) )
+
+    chambers, networks = store.chambers_of_users( ['1', '2'], edgelist, return_network=True )
+    for user in ['1', '2']:
+        assert edge_set( networks[user] ) == edge_set( ca.get_chamber_edgelist( user, edgelist ) )
+
+def test_graph_fingerprint_depends_on_user_labels():
+    edgelist = random_edgelist( 1 )
+    relabelled = edgelist.assign( source='x' + edgelist['source'], target='x' + edgelist['target'] )
+
+    graph, relabelled_graph = build_retweet_graph( edgelist ), build_retweet_graph( relabelled )
+    assert np.array_equal( graph.sources, relabelled_graph.sources )
+    assert week_fingerprint( graph ) != week_fingerprint( relabelled_graph )
+
+def test_fingerprints_are_evicted_with_the_store():
+    store = ChamberStore( max_items=4, max_graphs=1 )
+    edgelists = [ random_edgelist( seed ) for seed in range( 5 ) ]
+    for edgelist in edgelists:
+        store.chambers_of_users( ['1', '2', '3', '4'], edgelist )
+
+    assert len( store._fingerprints ) == 1
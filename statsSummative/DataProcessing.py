@@ -4,10 +4,10 @@ import pandas as pd
 import numpy as np
 import random as rnd
 import matplotlib.pyplot as plt
-from dateutil import parser
 from dateutil.relativedelta import relativedelta, SU
 from collections import Counter
 import datetime as dt
+import Timestamps as ts
 
 # dictionary for abbreviating topics
 topic_abb = {
@@ -40,8 +40,8 @@ def merge_preprocess_climate_tweets(climatepath, retweetpath, start=None, end=No
 
     combined_df = retweet_df.merge(climate_df, on='id', how='left')
 
-    # filtering combined data by time range
-    combined_df['date'] = combined_df['created_at'].map(lambda x: parser.parse(x).date())
+    # filtering combined data by time range (dates parsed in bulk, see Timestamps)
+    combined_df['date'] = ts.to_dates(ts.parse_climate_dates(combined_df['created_at']))
 
     if start is None and end is None:
         filtered_df = combined_df.copy()
@@ -94,10 +94,8 @@ def merge_preprocess_climate_tweets(climatepath, retweetpath, start=None, end=No
         else:
             #filtered_df['user_verified'] = filtered_df['user_verified'].map(lambda x: 1 if x=='True' else 0)
             #filtered_df['sensitive'] = filtered_df['sensitive'].map(lambda x: 1 if x=='True' else 0)
-            filtered_df['user_freq'] = filtered_df.apply(
-                lambda r: r['user_tweets'] / (1 + (dt.datetime(2022,11,30).date() - parser.parse(r['user_created_at']).date()).days),
-                axis = 1
-            )
+            user_begin = ts.parse_twitter_dates(filtered_df['user_created_at']).dt.tz_localize(None).dt.normalize()
+            filtered_df['user_freq'] = filtered_df['user_tweets'] / (1 + (pd.Timestamp(2022,11,30) - user_begin).dt.days)
             return filtered_df
 
 
@@ -1,55 +1,224 @@
+import os
+import io
+import numpy as np
 import pandas as pd
-import random as rnd
-import re
-from dateutil import parser
 import math
 import json
+import warnings
+import Timestamps as ts
 
-def get_date_range(file, start, end):
+def get_date_range(file, start, end, chunksize=1000000, use_index=True, build_index=False, index_path=None):
     '''
     file: filepath to Effrosynidis et al.'s climate data
     start: date object for start of range
     end: date object for end of range
+    chunksize: number of rows parsed at once
+    use_index: read only the blocks of the file that can hold dates in the range, using
+        the saved date index of the file if there is one (see build_date_index); otherwise
+        the whole file is streamed
+    build_index: build the date index (and try to save it at index_path) if there is none
+    index_path: path of the date index (default: next to the file, see date_index_path)
     output: return dataframe of tweets within a time range
     '''
-    
-    lines = []
-    with open(file) as f:
 
-        cols = re.sub('\n', '', f.readline()).split(',')
+    first, last = _utc_range(start, end)
+
+    index = None
+    if use_index:
+        index = load_date_index(file, index_path)
+        if index is None and build_index:
+            index = build_date_index(file, index_path=index_path)
+
+    if index is not None:
+        chunks = read_date_index_spans(file, index, first, last, chunksize)
+    else:
+        chunks = pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunksize)
+
+    return _filter_date_range(chunks, first, last, columns=pd.read_csv(file, dtype=str, nrows=0))
+
+def build_date_index(file, block_lines=10000, save=True, index_path=None):
+    '''
+    file: filepath to Effrosynidis et al.'s climate data
+    block_lines: number of lines per block of the index
+    save: write the index to index_path (default: next to the file, see date_index_path);
+        if it cannot be written, a warning is issued and the index is only returned
+    index_path: path of the date index
+    output: dataframe with the byte span (start, end) and the first and last dates (min_date,
+        max_date, in UTC) of every block of block_lines lines; built in one pass over the file.
+        If the file is sorted by date, the blocks of a range are contiguous, otherwise the blocks
+        whose dates do not overlap the range are still skipped. Blocks with no valid date have
+        NaT bounds and are always read.
+    '''
+
+    blocks = []
+    with open(file, 'rb') as f:
+
+        f.readline() # header
+        offset = f.tell()
+
+        while True:
+            lines = _read_lines(f, block_lines)
+            if len(lines) == 0:
+                break
+
+            # the first column holds the dates, parsed in bulk
+            dates = ts.parse_climate_dates([line.split(b',', 1)[0].decode() for line in lines])
+            end = offset + sum(len(line) for line in lines)
+            blocks.append((offset, end, dates.min(), dates.max(), len(lines)))
+            offset = end
 
-        for line in f:
-            date = parser.parse(line.split(',')[0]).date()
-            if date >= start and date <= end:
-                temp = {}
-                vals = re.sub('\n', '', line).split(',')
-                for index, key in enumerate(cols):
-                    temp[key] = vals[index]
-                lines.append(temp)
+    index = pd.DataFrame(blocks, columns=['start', 'end', 'min_date', 'max_date', 'rows'])
+    index.attrs['file_size'] = os.path.getsize(file)
 
-    return pd.DataFrame(lines, columns=cols)
+    if save:
+        try:
+            _save_date_index(file, index, index_path)
+        except OSError as e:
+            warnings.warn('The date index of %s could not be saved: %s' % (file, e))
 
-def get_sample_df(file, perc):
+    return index
+
+def load_date_index(file, index_path=None):
+    '''
+    file: filepath to Effrosynidis et al.'s climate data
+    index_path: path of the date index (default: next to the file, see date_index_path)
+    output: the saved date index of file, or None if there is none or the file changed since it was built
+    '''
+
+    path = index_path or date_index_path(file)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(file):
+        return None
+
+    index = pd.read_csv(path)
+    file_size = int(index['file_size'].iloc[0]) if len(index) > 0 else 0
+    if file_size != os.path.getsize(file):
+        return None
+
+    for column in ['min_date', 'max_date']:
+        index[column] = pd.to_datetime(index[column], utc=True)
+    return index.drop(columns='file_size')
+
+def date_index_path(file):
+    return file + '.dateindex.csv'
+
+def read_date_index_spans(file, index, first, last, chunksize=1000000):
+    '''
+    file: filepath to Effrosynidis et al.'s climate data
+    index: date index of file (see build_date_index)
+    first, last: UTC timestamps of the range [first, last)
+    output: generator of dataframes with the rows of the blocks overlapping the range; contiguous
+        blocks are read as one byte span, seeking past the rest of the file
+    '''
+
+    # blocks whose dates could not be parsed (NaT bounds) cannot be ruled out
+    overlapping = index[(index['max_date'].isna() | (index['max_date'] >= first)) &
+                        (index['min_date'].isna() | (index['min_date'] < last))]
+    if len(overlapping) == 0:
+        return
+
+    # merge contiguous blocks into byte spans
+    new_span = overlapping['start'].values[1:] != overlapping['end'].values[:-1]
+    span_ids = np.concatenate([[0], np.cumsum(new_span)])
+    spans = overlapping.groupby(span_ids).agg({'start': 'min', 'end': 'max'})
+
+    with open(file, 'rb') as f:
+        header = f.readline()
+
+        for start, end in zip(spans['start'], spans['end']):
+            f.seek(start)
+            data = io.BytesIO(header + f.read(end - start))
+            yield from pd.read_csv(data, dtype=str, keep_default_na=False, chunksize=chunksize)
+
+def get_sample_df(file, perc, seed=None, chunksize=1000000):
     '''
     file: filepath to Effrosynidis et al.'s climate data
     perc: the liklihood of sampling each row
+    seed: seed of the numpy random generator, for reproducible samples
+    chunksize: number of rows parsed at once (memory is bounded by a chunk and the sample)
     output: return dataframe with approximatley "perc"% of the dataset
     '''
 
-    lines = []
-    with open(file) as f:
+    rng = np.random.default_rng(seed)
+
+    samples = [pd.read_csv(file, dtype=str, nrows=0)]
+    for chunk in pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunksize):
+        samples.append(chunk[rng.random(len(chunk)) <= perc])
+
+    return pd.concat(samples, ignore_index=True)
+
+def get_stratified_sample_df(file, by='week', frac=None, n=None, seed=None, chunksize=1000000):
+    '''
+    file: filepath to Effrosynidis et al.'s climate data
+    by: column defining the strata (e.g. 'topic'), or 'week' for the week of the date
+        (ending on Sunday, as in DataProcessing)
+    frac: the liklihood of sampling each row, or a dictionary with the liklihood per stratum
+    n: number of rows sampled uniformly per stratum (all of them if the stratum is smaller),
+        with a reservoir per stratum; exactly one of frac and n must be given
+    seed: seed of the numpy random generator, for reproducible samples
+    chunksize: number of rows parsed at once (memory is bounded by a chunk and the sample)
+    output: return dataframe with the sampled rows, in the order of the file
+    '''
 
-        cols = re.sub('\n', '', f.readline()).split(',')
+    assert (frac is None) != (n is None), "give either frac or n"
+
+    rng = np.random.default_rng(seed)
+
+    columns = pd.read_csv(file, dtype=str, nrows=0)
+    samples = [columns]
+    reservoir = None
+    for chunk in pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunksize):
+        strata = _strata(chunk, by)
+
+        if frac is not None:
+            perc = strata.map(frac).fillna(0).to_numpy() if isinstance(frac, dict) else frac
+            samples.append(chunk[rng.random(len(chunk)) <= perc])
+            continue
+
+        # reservoir sampling: every row gets a uniform random key and each stratum keeps
+        # the rows with its n smallest keys seen so far
+        chunk = chunk.assign(_key=rng.random(len(chunk)), _stratum=strata.to_numpy())
+        reservoir = chunk if reservoir is None else pd.concat([reservoir, chunk])
+        reservoir = reservoir.sort_values('_key', kind='stable').groupby('_stratum', sort=False, dropna=False).head(n)
+
+    if reservoir is not None:
+        # the index of the chunks is the row number in the file
+        samples.append(reservoir.sort_index().drop(columns=['_key', '_stratum']))
+
+    return pd.concat(samples, ignore_index=True)
+
+## Helpers
+def _utc_range(start, end):
+    # [start, end + 1 day) in UTC, so that the comparisons run on the parsed datetimes
+    first = pd.Timestamp(start).tz_localize('UTC')
+    last = pd.Timestamp(end).tz_localize('UTC') + pd.Timedelta(days=1)
+    return first, last
+
+def _filter_date_range(chunks, first, last, columns):
+    filtered = [columns]
+    for chunk in chunks:
+        # the first column holds the dates, parsed in bulk
+        dates = ts.parse_climate_dates(chunk.iloc[:, 0])
+        filtered.append(chunk[(dates >= first) & (dates < last)])
+
+    return pd.concat(filtered, ignore_index=True)
+
+def _read_lines(f, n):
+    lines = []
+    for line in f:
+        lines.append(line)
+        if len(lines) == n:
+            break
+    return lines
 
-        for line in f:
-    
-            if rnd.uniform(0,1) <= perc:
-                temp = {}
-                vals = re.sub('\n', '', line).split(',')
-                for index, key in enumerate(cols):
-                    temp[key] = vals[index]
-                lines.append(temp)
+def _save_date_index(file, index, index_path=None):
+    saved = index.copy()
+    saved['file_size'] = index.attrs['file_size']
+    saved.to_csv(index_path or date_index_path(file), index=False)
 
-        df = pd.DataFrame(lines, columns=cols)
+def _strata(chunk, by):
+    if by != 'week':
+        return chunk[by]
 
-    return df
\ No newline at end of file
+    # week ending on Sunday of the date in the first column
+    dates = ts.parse_climate_dates(chunk.iloc[:, 0]).dt.tz_localize(None).dt.normalize()
+    return ts.to_dates(dates + pd.to_timedelta((6 - dates.dt.dayofweek) % 7, unit='D'))
@@ -0,0 +1,53 @@
+import pandas as pd
+from dateutil import parser
+
+# fixed formats of the timestamps in our data
+TWITTER_FORMAT = '%a %b %d %H:%M:%S %z %Y' # created_at of tweets and users, e.g. 'Wed Oct 10 20:19:24 +0000 2018'
+CLIMATE_FORMAT = '%Y-%m-%d %H:%M:%S%z'     # created_at of Effrosynidis et al.'s climate data, e.g. '2018-10-10 20:19:24+00:00'
+
+def parse_timestamps(values, format):
+    '''
+    values: sequence (or series) of timestamp strings
+    format: strftime format of the timestamps
+    output: series of UTC datetimes (with the index of values, if a series), parsed in bulk with the
+        fixed format; only the values not matching it go through the generic dateutil parser (NaT if
+        they cannot be parsed either)
+    '''
+
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values, dtype=object)
+
+    parsed = pd.to_datetime(values, format=format, errors='coerce', utc=True)
+
+    malformed = parsed.isna() & values.notna()
+    if malformed.any():
+        parsed[malformed] = pd.to_datetime(values[malformed].map(_parse_one), utc=True)
+
+    return parsed
+
+def parse_twitter_dates(values):
+    '''
+    values: twitter created_at strings
+    output: series of UTC datetimes (see parse_timestamps)
+    '''
+    return parse_timestamps(values, TWITTER_FORMAT)
+
+def parse_climate_dates(values):
+    '''
+    values: created_at strings of the climate data
+    output: series of UTC datetimes (see parse_timestamps)
+    '''
+    return parse_timestamps(values, CLIMATE_FORMAT)
+
+def to_dates(timestamps):
+    '''
+    timestamps: series of datetimes
+    output: series of date objects (None for NaT)
+    '''
+    return timestamps.dt.date.where(timestamps.notna(), None)
+
+def _parse_one(value):
+    try:
+        return parser.parse(value)
+    except (ValueError, OverflowError, TypeError):
+        return None
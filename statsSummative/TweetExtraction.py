@@ -1,149 +1,227 @@
+import os
+import numpy as np
 import pandas as pd
-import json
-from dateutil import parser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import TweetFields as tf
+import Timestamps as ts
+
+# columns of the retweet network (see TweetFields.RETWEET_FIELDS) and their dtypes in the column batches;
+# the metadata of the users can be missing, so it is kept in nullable pandas arrays
+RETWEET_COLUMNS = list(tf.RETWEET_FIELDS.keys())
+RETWEET_DTYPES = {
+    'author_followers': 'Int64',
+    'infl_followers': 'Int64',
+    'infl_verified': 'boolean',
+    'infl_total': 'Int64',
+}
+
+# retweets and quotes are skipped before decoding by the extractors of original tweets
+ORIGINAL_EXCLUDES = [tf.RETWEET_PATTERN, tf.QUOTE_PATTERN]
+
+def iter_retweet_rows(file, byte_range=None):
+    '''
+    file: filepath for jsonl from hydrator app (can be gzipped)
+    byte_range: optional byte range of file (see TweetFields.iter_lines)
+    output: generator of tuples with the RETWEET_COLUMNS of every retweet (infl_begin unparsed);
+        lines without a "retweeted_status" object are skipped before decoding
+    '''
+
+    return tf.iter_projected(file, tf.RETWEET_FIELDS, contains=tf.RETWEET_PATTERN, where=tf.is_retweet, byte_range=byte_range)
 
 def extract_hydrated_retweets(file):
     '''
-    file: filepath for jsonl from hydrator app
+    file: filepath for jsonl from hydrator app (can be gzipped)
     output: list of dictionaries with minimal
     '''
 
-    retweet_list = []
-
-    with open(file) as f:
-
-        for line in f:
-            tweet = json.loads(line)
-            try:
-                status = tweet['retweeted_status']
-                temp = {}
-                temp['id'] = str(tweet['id_str'])
-                temp['text'] = tweet['full_text']
-                temp['influencer'] = status['user']['screen_name']
-                temp['author_id'] = str(tweet['user']['id'])
-                temp['author_name'] = tweet['user']['screen_name']
-                temp['author_followers'] = tweet['user']['followers_count']
-                temp['infl_id'] = str(status['user']['id'])
-                temp['infl_followers'] = status['user']['followers_count']
-                temp['infl_verified'] = status['user']['verified']
-                temp['infl_total'] = status['user']['statuses_count']
-                temp['infl_begin'] = parser.parse(status['user']['created_at'])
-                retweet_list.append(temp)
-            except:
-                continue
-        
-    return retweet_list
-
-def get_retweet_network(chunk_files):
-
-    retweet_list = []
-    for chunk in chunk_files:
-        retweet_list = retweet_list + extract_hydrated_retweets(chunk)
-    
-    return pd.DataFrame(retweet_list)
+    retweet_list = [dict(zip(RETWEET_COLUMNS, row)) for row in iter_retweet_rows(file)]
+
+    # dates are parsed in bulk, retweets with unparseable dates are dropped
+    infl_begin = ts.parse_twitter_dates([temp['infl_begin'] for temp in retweet_list])
+    for temp, begin in zip(retweet_list, infl_begin):
+        temp['infl_begin'] = begin
+
+    return [temp for temp, begin in zip(retweet_list, infl_begin) if not pd.isna(begin)]
+
+def iter_retweet_batches(file, batch_size=100000, byte_range=None):
+    '''
+    file: filepath for jsonl from hydrator app (can be gzipped)
+    batch_size: number of retweets per batch
+    byte_range: optional byte range of file (see TweetFields.iter_lines)
+    output: generator of column batches (see retweet_batch) with the retweets of file
+    '''
+
+    rows = []
+    for row in iter_retweet_rows(file, byte_range):
+        rows.append(row)
+
+        if len(rows) == batch_size:
+            yield retweet_batch(rows)
+            rows = []
+
+    if len(rows) > 0:
+        yield retweet_batch(rows)
+
+def retweet_batch(rows):
+    '''
+    rows: list of tuples returned by iter_retweet_rows
+    output: dict of RETWEET_COLUMNS -> array, with object strings, infl_begin as datetime64 in UTC
+        (rows with unparseable dates are dropped) and the counts and verified flags as nullable
+        pandas arrays (Int64, boolean), missing or non-numeric values being <NA>
+    '''
+
+    columns = dict(zip(RETWEET_COLUMNS, zip(*rows)))
+
+    infl_begin = parse_created_at(columns['infl_begin'])
+    valid = ~np.isnat(infl_begin)
+
+    batch = {}
+    for name in RETWEET_COLUMNS:
+        if name == 'infl_begin':
+            values = infl_begin
+        elif name in RETWEET_DTYPES:
+            values = pd.to_numeric(pd.Series(columns[name], dtype=object), errors='coerce').astype(RETWEET_DTYPES[name]).array
+        else:
+            values = np.array(columns[name], dtype=object)
+        batch[name] = values if valid.all() else values[valid]
+
+    return batch
+
+def parse_created_at(values):
+    '''
+    values: sequence of twitter created_at strings
+    output: datetime64 array in UTC, NaT for unparseable values (see Timestamps.parse_twitter_dates)
+    '''
+
+    return ts.parse_twitter_dates(values).dt.tz_convert(None).to_numpy()
+
+def stream_retweet_batches(chunk_files, batch_size=100000, n_jobs=None, executor=None, chunk_bytes=64 * 2**20):
+    '''
+    chunk_files: filepaths for jsonl from hydrator app (can be gzipped)
+    batch_size: number of retweets per batch
+    n_jobs: number of worker processes parsing files in parallel (None parses them here)
+    executor: optional concurrent.futures executor to use instead of a new process pool
+    chunk_bytes: size of the byte ranges of the files parsed by every worker task (gzipped files
+        are parsed as a whole, see TweetFields.split_jsonl)
+    output: generator of column batches (see retweet_batch), in the order of chunk_files
+    '''
+
+    if n_jobs is None and executor is None:
+        for file in chunk_files:
+            yield from iter_retweet_batches(file, batch_size)
+        return
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+
+    # every task parses a byte range of a file, and at most a couple of ranges per worker are
+    # parsed ahead, so memory stays bounded by a few ranges whatever the size of the files
+    max_pending = 2 * (n_jobs or os.cpu_count() or 1)
+    pending = deque()
+    try:
+        for file in chunk_files:
+            for byte_range in tf.split_jsonl(file, chunk_bytes):
+                pending.append(executor.submit(_retweet_batches_of_range, file, batch_size, byte_range))
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # nothing is left running on a caller's executor if the stream is closed or fails
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+def batches_to_dataframe(batches, columns=RETWEET_COLUMNS):
+    '''
+    batches: iterable of column batches
+    output: dataframe with all the batches (infl_begin as a UTC datetime column)
+    '''
+
+    batches = list(batches)
+    if len(batches) == 0:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.DataFrame({name: _concatenate([batch[name] for batch in batches]) for name in columns})
+    if 'infl_begin' in df.columns:
+        df['infl_begin'] = df['infl_begin'].dt.tz_localize('UTC')
+    return df
+
+def get_retweet_network(chunk_files, n_jobs=None, executor=None):
+    '''
+    chunk_files: filepaths for jsonl from hydrator app (can be gzipped)
+    n_jobs: number of worker processes parsing files in parallel (see stream_retweet_batches)
+    output: dataframe of retweets
+    '''
+
+    return batches_to_dataframe(stream_retweet_batches(chunk_files, n_jobs=n_jobs, executor=executor))
 
 def get_user_tweets(file, user_dict):
     '''
-    file: filepath for jsonl from hydrator app
+    file: filepath for jsonl from hydrator app (can be gzipped)
     user_file: list of users whom you want to get tweets from
     output: list of dictionaries with minimal
     '''
 
+    # original tweets (neither retweets nor quotes) of the users in user_dict
+    columns = list(tf.USER_TWEET_FIELDS.keys())
+    author_index = columns.index('author_id')
+    candidates = [
+        dict(zip(columns, row)) for row in tf.iter_projected(file, tf.USER_TWEET_FIELDS, where=tf.is_original, excludes=ORIGINAL_EXCLUDES)
+        if row[author_index] in user_dict
+    ]
+
+    # checks that the tweet belongs to user per time period, with the dates parsed in bulk
+    created_at = ts.parse_twitter_dates([temp.pop('created_at') for temp in candidates])
+    periods = created_at.dt.year.astype('Int64').astype(str) + '-' + created_at.dt.month.astype('Int64').astype(str)
+    begin = ts.parse_twitter_dates([temp['begin'] for temp in candidates])
+
     tweet_list = []
+    for temp, period, begin_date in zip(candidates, periods, begin):
+        if period in user_dict[temp['author_id']]:
+            temp['begin'] = begin_date
+            tweet_list.append(temp)
 
-    with open(file) as f:
-
-        for line in f:
-            try:
-                # checks that the tweet belongs to user per time period
-                tweet = json.loads(line)
-                author_id = str(tweet['user']['id'])
-                date = parser.parse(tweet['created_at']).date()
-                assert author_id in user_dict.keys()
-                assert str(f"{date.year}-{date.month}") in user_dict[author_id]
-                # checks to ensure the tweet is original
-                status = tweet['retweeted_status']
-                continue
-            except KeyError as e:
-                if not tweet['is_quote_status']:
-                    temp = {}
-                    temp['id'] = str(tweet['id_str'])
-                    temp['text'] = tweet['full_text']
-                    temp['author_id'] = author_id
-                    temp['author_name'] = tweet['user']['screen_name']
-                    temp['followers'] = tweet['user']['followers_count']
-                    temp['verified'] = tweet['user']['verified']
-                    temp['total'] = tweet['user']['statuses_count']
-                    temp['begin'] = parser.parse(tweet['user']['created_at'])
-                    tweet_list.append(temp)
-            except AssertionError as e:
-                continue
-    
     return tweet_list
 
 def get_tweets(chunk_files, user_dict):
 
     tweet_list = []
     for chunk in chunk_files:
-        tweet_list = tweet_list + get_user_tweets(chunk, user_dict)
-    
+        tweet_list.extend(get_user_tweets(chunk, user_dict))
+
     return pd.DataFrame(tweet_list)
 
 def extract_tweets(file):
     '''
-    file: filepath for jsonl from hydrator app
+    file: filepath for jsonl from hydrator app (can be gzipped)
     user_file: list of users whom you want to get tweets from
     output: list of dictionaries with minimal
     '''
 
-    tweet_list = []
-
-    with open(file) as f:
-
-        for line in f:
-            tweet = json.loads(line)
-
-            if not 'retweeted_status' in tweet and not tweet['is_quote_status']:
-                temp = {}
-                # tweet level data
-                temp['id'] = tweet['id_str']
-                temp['text'] = tweet['full_text']
-                temp['hashtags'] = len(tweet['entities']['hashtags']) \
-                    if 'hashtags' in tweet['entities'] else 0
-                temp['mentions'] = len(tweet['entities']['user_mentions']) \
-                    if 'user_mentions' in tweet['entities'] else 0
-                temp['urls'] = len(tweet['entities']['urls']) \
-                    if 'urls' in tweet['entities'] else 0
-                temp['media'] = len(tweet['entities']['media']) \
-                    if 'media' in tweet['entities'] else 0
-                temp['symbols'] = len(tweet['entities']['symbols']) \
-                    if 'symbols' in tweet['entities'] else 0
-                temp['polls'] = len(tweet['entities']['polls']) \
-                    if 'polls' in tweet['entities'] else 0
-                temp['retweets'] = tweet['retweet_count']
-                temp['favorites'] = tweet['favorite_count']
-                temp['sensitive'] = tweet['possibly_sensitive'] \
-                    if 'possibly_sensitive' in tweet else 'False'
-
-                # user level data
-                temp['user_id'] = tweet['user']['id_str']
-                temp['user_name'] = tweet['user']['screen_name']
-                temp['user_followers'] = tweet['user']['followers_count']
-                temp['user_friends'] = tweet['user']['friends_count']
-                temp['user_created_at'] = tweet['user']['created_at']
-                temp['user_favorites'] = tweet['user']['favourites_count']
-                temp['user_verified'] = tweet['user']['verified']
-                temp['user_tweets'] = tweet['user']['statuses_count']
-
-                tweet_list.append(temp)
-    
-    return tweet_list
+    # original tweets only (neither retweets nor quotes), see TweetFields.TWEET_FIELDS for the columns
+    columns = list(tf.TWEET_FIELDS.keys())
+    return [dict(zip(columns, row)) for row in tf.iter_projected(file, tf.TWEET_FIELDS, where=tf.is_original, excludes=ORIGINAL_EXCLUDES)]
 
 def get_all_tweets(chunk_files):
 
     tweet_list = []
     for chunk in chunk_files:
-        tweet_list = tweet_list + extract_tweets(chunk)
-    
+        tweet_list.extend(extract_tweets(chunk))
+
     return pd.DataFrame(tweet_list)
 
+## Helpers
+def _retweet_batches_of_range(file, batch_size, byte_range):
+    # top-level, so that it can be sent to worker processes
+    return list(iter_retweet_batches(file, batch_size, byte_range))
+
+def _concatenate(arrays):
+    # nullable pandas arrays are concatenated by pandas, numpy arrays by numpy
+    if isinstance(arrays[0], pd.api.extensions.ExtensionArray):
+        return pd.concat([pd.Series(array) for array in arrays], ignore_index=True).array
+    return np.concatenate(arrays)
@@ -0,0 +1,241 @@
+import os
+import re
+import gzip
+import json
+
+# orjson is used when it is installed, it decodes tweets several times faster than json
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    orjson = None
+    loads = json.loads
+
+# value of the optional fields that are missing
+NAN = float('nan')
+
+# the fields each extractor keeps, as column -> dotted path (or (path, default, func), see compile_fields)
+RETWEET_FIELDS = {
+    'id': ('id_str', None, str),
+    'text': 'full_text',
+    'influencer': 'retweeted_status.user.screen_name',
+    'author_id': ('user.id', None, str),
+    'author_name': 'user.screen_name',
+    # metadata of the users, retweets missing them are kept (they are edges of the network)
+    'author_followers': ('user.followers_count', NAN, None),
+    'infl_id': ('retweeted_status.user.id', None, str),
+    'infl_followers': ('retweeted_status.user.followers_count', NAN, None),
+    'infl_verified': ('retweeted_status.user.verified', NAN, None),
+    'infl_total': ('retweeted_status.user.statuses_count', NAN, None),
+    'infl_begin': 'retweeted_status.user.created_at',
+}
+
+USER_TWEET_FIELDS = {
+    'id': ('id_str', None, str),
+    'text': 'full_text',
+    'author_id': ('user.id', None, str),
+    'author_name': 'user.screen_name',
+    'followers': 'user.followers_count',
+    'verified': 'user.verified',
+    'total': 'user.statuses_count',
+    'begin': 'user.created_at',
+    'created_at': 'created_at',
+}
+
+TWEET_FIELDS = {
+    # tweet level data
+    'id': 'id_str',
+    'text': 'full_text',
+    'hashtags': ('entities.hashtags', 0, len),
+    'mentions': ('entities.user_mentions', 0, len),
+    'urls': ('entities.urls', 0, len),
+    'media': ('entities.media', 0, len),
+    'symbols': ('entities.symbols', 0, len),
+    'polls': ('entities.polls', 0, len),
+    'retweets': 'retweet_count',
+    'favorites': 'favorite_count',
+    'sensitive': ('possibly_sensitive', 'False', None),
+    # user level data
+    'user_id': 'user.id_str',
+    'user_name': 'user.screen_name',
+    'user_followers': 'user.followers_count',
+    'user_friends': 'user.friends_count',
+    'user_created_at': 'user.created_at',
+    'user_favorites': 'user.favourites_count',
+    'user_verified': 'user.verified',
+    'user_tweets': 'user.statuses_count',
+}
+
+# byte pattern of the key of retweets, lines without it are not retweets
+RETWEET_KEY = b'"retweeted_status"'
+# byte patterns of the (unescaped) keys of retweets and quotes with a value: a line is a retweet iff it has a
+# "retweeted_status" object (quoted statuses are never retweets), and a quote iff "is_quote_status" is true
+RETWEET_PATTERN = re.compile(rb'"retweeted_status"\s*:\s*\{')
+QUOTE_PATTERN = re.compile(rb'"is_quote_status"\s*:\s*true')
+
+class MissingField(KeyError):
+    pass
+
+def open_jsonl(file):
+    '''
+    file: filepath for jsonl from hydrator app, plain or gzipped
+    output: binary file object (gzip is detected from the magic bytes, not the extension)
+    '''
+
+    with open(file, 'rb') as f:
+        magic = f.read(2)
+
+    if magic == b'\x1f\x8b':
+        return gzip.open(file, 'rb')
+    return open(file, 'rb')
+
+def compile_fields(fields):
+    '''
+    fields: dict of column -> 'dotted.path' or (path, default, func); a field with
+        default None is required, and func (if any) is applied to the value found
+    output: list of (column, keys, default, func)
+    '''
+
+    compiled = []
+    for column, spec in fields.items():
+        path, default, func = (spec, None, None) if isinstance(spec, str) else spec
+        if default is None:
+            default = MissingField
+        compiled.append((column, tuple(path.split('.')), default, func))
+
+    return compiled
+
+def project(tweet, compiled):
+    '''
+    tweet: decoded tweet object
+    compiled: fields returned by compile_fields
+    output: tuple with the value of every field, raises MissingField if a required field is missing;
+        values that func cannot be applied to (e.g. len of a null entity) are NAN
+    '''
+
+    row = []
+    for column, keys, default, func in compiled:
+        value = tweet
+        try:
+            for key in keys:
+                value = value[key]
+        except (KeyError, TypeError):
+            if default is MissingField:
+                raise MissingField(column)
+            row.append(default)
+            continue
+
+        if func is not None:
+            try:
+                value = func(value)
+            except (TypeError, ValueError):
+                value = NAN
+        row.append(value)
+
+    return tuple(row)
+
+def iter_lines(file, byte_range=None):
+    '''
+    file: filepath for jsonl from hydrator app (can be gzipped)
+    byte_range: optional (start, end) of a plain file; only the lines starting in [start, end) are read,
+        so that consecutive ranges split the file without overlap (see split_jsonl)
+    output: generator of the lines of file
+    '''
+
+    if byte_range is None:
+        with open_jsonl(file) as f:
+            yield from f
+        return
+
+    start, end = byte_range
+    with open(file, 'rb') as f:
+        if start > 0:
+            # the line running over start belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+def split_jsonl(file, chunk_bytes=64 * 2**20):
+    '''
+    file: filepath for jsonl from hydrator app (can be gzipped)
+    chunk_bytes: size of the byte ranges
+    output: list of the byte ranges (see iter_lines) of about chunk_bytes covering file, or [None] if
+        it is gzipped (it can only be read as a whole)
+    '''
+
+    with open(file, 'rb') as f:
+        if f.read(2) == b'\x1f\x8b':
+            return [None]
+
+    size = os.path.getsize(file)
+    return [(start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+
+def iter_tweets(file, contains=None, byte_range=None, excludes=None):
+    '''
+    file: filepath for jsonl from hydrator app (can be gzipped)
+    contains: optional pattern (or list of patterns), bytes or compiled bytes regex; lines without
+        all of them are skipped without being decoded
+    byte_range: optional byte range of file (see iter_lines)
+    excludes: optional pattern (or list of patterns); lines with any of them are skipped without
+        being decoded
+    output: generator of decoded tweets
+    '''
+
+    contains, excludes = _pattern_list(contains), _pattern_list(excludes)
+
+    for line in iter_lines(file, byte_range):
+        if not all(_matches(pattern, line) for pattern in contains):
+            continue
+        if any(_matches(pattern, line) for pattern in excludes):
+            continue
+        if not line.strip():
+            continue
+        yield loads(line)
+
+def iter_projected(file, fields, contains=None, where=None, byte_range=None, excludes=None):
+    '''
+    file: filepath for jsonl from hydrator app (can be gzipped)
+    fields: dict of fields to keep (see compile_fields)
+    contains, excludes: byte prefilters (see iter_tweets)
+    where: optional function of the decoded tweet, tweets for which it is False are skipped
+    byte_range: optional byte range of file (see iter_lines)
+    output: generator of the tuples of fields of the tweets (tweets missing required fields are skipped)
+    '''
+
+    compiled = compile_fields(fields)
+    for tweet in iter_tweets(file, contains, byte_range, excludes):
+        if where is not None and not where(tweet):
+            continue
+        try:
+            yield project(tweet, compiled)
+        except MissingField:
+            continue
+
+def is_retweet(tweet):
+    return 'retweeted_status' in tweet
+
+def is_original(tweet):
+    '''
+    output: True if tweet is neither a retweet nor a quote
+    '''
+    return 'retweeted_status' not in tweet and not tweet.get('is_quote_status', False)
+
+## Helpers
+def _pattern_list(patterns):
+    if patterns is None:
+        return []
+    if isinstance(patterns, (bytes, re.Pattern)):
+        return [patterns]
+    return list(patterns)
+
+def _matches(pattern, line):
+    if isinstance(pattern, bytes):
+        return pattern in line
+    return pattern.search(line) is not None